@@ -0,0 +1,43 @@
+"""
+Import time of the geometry-only path of constellations.py.
+
+Imports constellations in a fresh interpreter several times, checks that this did not
+pull in matplotlib, and compares the fastest import against a time budget. Exits with
+status 1 if the budget is exceeded.
+
+    python benchmarks/bench_constellations_import.py [budget_seconds]
+"""
+import os
+import subprocess
+import sys
+
+BUDGET = 0.25   # seconds, including the import of numpy
+REPEATS = 5
+
+SCRIPT = """
+import sys, time
+start = time.time()
+import constellations
+elapsed = time.time() - start
+constellations.radec2xyz(1, 10., 20.)
+print("%r %r" % (elapsed, 'matplotlib' in sys.modules))
+"""
+
+
+def measure():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for i in range(REPEATS):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=root)
+        elapsed, matplotlib_loaded = output.decode().split()
+        if matplotlib_loaded == 'True':
+            raise RuntimeError("importing constellations loaded matplotlib")
+        times.append(float(elapsed))
+    return min(times)
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET
+    elapsed = measure()
+    print("import constellations: %.3f s (budget %.3f s)" % (elapsed, budget))
+    sys.exit(0 if elapsed <= budget else 1)
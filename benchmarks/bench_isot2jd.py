@@ -0,0 +1,84 @@
+"""
+Throughput of isot2jd, the bulk ISO-8601 / DATE-OBS parser in idlastro_ports/gd2jd.py.
+
+Parses N random timestamps of the form 2017-03-14T05:06:07.123456 given as an array of
+bytes, an array of str, and a memory-mapped text file of one timestamp per line, and
+reports the dates per second for each, against datetime.strptime plus gd2jd on a sample
+of rows. Checks the parsed dates against the numpy datetime64 values they were made from.
+
+    python benchmarks/bench_isot2jd.py [N]
+"""
+from __future__ import print_function
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'idlastro_ports'))
+from gd2jd import gd2jd, isot2jd
+
+N = 10**6
+REPEATS = 3
+FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def make_dates(n, seed=0):
+    """ n random timestamps as a bytes array, and the JD of each """
+    rng = np.random.RandomState(seed)
+    days = rng.randint(0, 365 * 40, n).astype('timedelta64[D]')
+    us = rng.randint(0, 86400 * 10**6, n).astype('timedelta64[us]')
+    stamps = np.datetime64('1990-01-01T00:00:00', 'us') + days + us
+    text = np.datetime_as_string(stamps, unit='us').astype('S26')
+    jd = (stamps - np.datetime64('1970-01-01T00:00:00', 'us')).astype(np.float64) / 86400e6 + 2440587.5
+    return text, jd
+
+
+def best_rate(func, n):
+    times = []
+    for i in range(REPEATS):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return n / min(times)
+
+
+def baseline_rate(text, n=20000):
+    """ Dates per second parsed one at a time with strptime and converted with gd2jd """
+    sample = [t.decode() for t in text[:n]]
+    start = time.time()
+    for t in sample:
+        d = datetime.datetime.strptime(t, FORMAT)
+        gd2jd(d.year, d.month, d.day, d.hour, d.minute, d.second + d.microsecond * 1e-6)
+    return len(sample) / (time.time() - start)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else N
+    text, expected = make_dates(n)
+
+    jd = isot2jd(text)
+    error = np.abs(jd - expected).max() * 86400
+    if error > 1e-4:
+        raise RuntimeError("isot2jd disagrees with the input timestamps by %g s" % error)
+
+    unicode_text = text.astype('U26')
+    handle, filename = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(b'\n'.join(text) + b'\n')
+        column = np.memmap(filename, dtype=np.uint8, mode='r')
+        rates = [('bytes array', best_rate(lambda: isot2jd(text), n)),
+                 ('str array', best_rate(lambda: isot2jd(unicode_text), n)),
+                 ('memmap text column', best_rate(lambda: isot2jd(column), n))]
+        del column
+    finally:
+        os.remove(filename)
+
+    print("isot2jd, %d dates (max error %.1e s):" % (n, error))
+    for name, rate in rates:
+        print("  %-20s %12.0f dates/s" % (name, rate))
+    print("  %-20s %12.0f dates/s" % ('strptime + gd2jd', baseline_rate(text)))
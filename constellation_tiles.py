@@ -0,0 +1,150 @@
+import io
+import os
+import time
+import multiprocessing
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import constellations
+
+
+def _init_worker():
+    """ Load the constellation catalog and build its index, once per worker process """
+    constellations._segment_index()
+
+
+def render_tile(center, size, pixels=256, dpi=100, color='blue', linewidth=1., densify=0.5,
+        filename=None):
+    """ Draw the constellation figures in one square field, as a PNG image.
+
+    The field is drawn in the gnomonic projection, with east to the left, using only the
+    segments which pass through it. Nothing else is drawn, and the background is transparent,
+    so the tile can be used as an overlay.
+
+    Parameters
+    -----------
+    center : tuple of floats
+        RA and Dec of the field center, in degrees
+    size : float
+        Width of the field in degrees of the tangent plane
+    pixels : int
+        Width and height of the tile in pixels
+    dpi : float
+        Resolution of the tile, which sets the scale of the line widths
+    color, linewidth :
+        Line properties
+    densify : float
+        Draw segments along their great circles in pieces of this many degrees,
+        or None to draw straight lines between their endpoints.
+    filename : string
+        If set, write the PNG to this file; otherwise return its contents.
+
+    Returns
+    --------
+    The filename, or the PNG image as a bytes string.
+    """
+    fig = Figure(figsize=(pixels*1.0/dpi, pixels*1.0/dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    half = size/2.
+    ax.set_xlim(half, -half)
+    ax.set_ylim(-half, half)
+
+    # tangent plane offsets are never smaller than the angles, so the corners are within this
+    radius = min(half*np.sqrt(2) + 1, 89.)
+    segs = constellations.segments_in_cone(center[0], center[1], radius)
+    if densify is not None:
+        segs = constellations.densify_segments(segs, densify)
+    verts, source = constellations.project_segments(segs, 'gnomonic', center=center, horizon=radius)
+    constellations.draw_segments(ax, verts, segs['drawcode'][source], color=color, linewidths=linewidth)
+
+    if filename is not None:
+        fig.savefig(filename, dpi=dpi, transparent=True)
+        return filename
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, transparent=True)
+    return buf.getvalue()
+
+
+def _render_job(job):
+    """ Render one tile in a worker, returning the result and how long it took """
+    start = time.time()
+    result = render_tile(**job)
+    return result, time.time() - start
+
+
+def render_tiles(centers, sizes, outdir=None, processes=None, chunksize=8, densify=0.5, **kwargs):
+    """ Render many constellation overlay tiles in parallel.
+
+    Tiles are farmed out to a pool of processes, each of which loads the constellation
+    catalog once when it starts. See render_tile for the drawing.
+
+    Parameters
+    -----------
+    centers : sequence of (ra, dec)
+        Field centers, in degrees
+    sizes : float or sequence of floats
+        Field widths, in degrees, one for all tiles or one per tile
+    outdir : string
+        If set, write the tiles to outdir/tile_00000.png etc. and return the filenames;
+        otherwise return the PNG images as bytes strings.
+    processes : int
+        Number of worker processes; defaults to the number of CPUs. Set to 1 to render
+        in this process, without a pool.
+    chunksize : int
+        Number of tiles handed to a worker at a time
+    densify : float
+        Passed to render_tile, which densifies only the segments within each tile.
+    Other keywords are passed to render_tile.
+
+    Returns
+    --------
+    results : list
+        Filenames or PNG images, in the order of centers
+    stats : dict
+        Throughput and latency: ntiles, wall_time (s), tiles_per_sec, and the mean,
+        median, p95 and max of the per-tile rendering latency (s).
+    """
+    centers = [(float(ra), float(dec)) for ra, dec in centers]
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=float), (len(centers),))
+
+    jobs = []
+    for i, (center, size) in enumerate(zip(centers, sizes)):
+        job = dict(kwargs, center=center, size=size, densify=densify)
+        if outdir is not None:
+            job['filename'] = os.path.join(outdir, "tile_%05d.png" % i)
+        jobs.append(job)
+
+    start = time.time()
+    if processes == 1:
+        _init_worker()
+        output = [_render_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            output = pool.map(_render_job, jobs, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    wall_time = time.time() - start
+
+    results = [r for r, latency in output]
+    latencies = np.array([latency for r, latency in output])
+    stats = dict(ntiles=len(jobs), wall_time=wall_time,
+                 tiles_per_sec=len(jobs) / wall_time if wall_time > 0 else np.inf)
+    if len(jobs):
+        stats.update(latency_mean=latencies.mean(), latency_median=np.median(latencies),
+                     latency_p95=np.percentile(latencies, 95), latency_max=latencies.max())
+    return results, stats
+
+
+if __name__ == "__main__":
+    ntiles = 500
+    centers = np.column_stack((np.random.uniform(0, 360, ntiles),
+                               np.degrees(np.arcsin(np.random.uniform(-1, 1, ntiles)))))
+    results, stats = render_tiles(centers, 10.)
+    for key in ('ntiles', 'wall_time', 'tiles_per_sec', 'latency_mean', 'latency_median', 'latency_p95', 'latency_max'):
+        print("%15s: %g" % (key, stats[key]))
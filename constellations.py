@@ -1,9 +1,108 @@
+import collections
 import numpy as np
-import matplotlib as plt
-import pylab
 
+# matplotlib is only imported when something is drawn, so that the catalog and geometry
+# functions can be used without it.
 
-def constellations(plot=False, plot3d=False, color='blue', radius=None, greatcircles=True):
+
+# XEphem ConFig records, packed: drawcode, ra (hours * 1800), dec (degrees * 60)
+_CONFIG_DTYPE = np.dtype([('drawcode', np.int8), ('ra', np.uint16), ('dec', np.int16)])
+
+# Packed catalog, built on first use by _load_catalog() and shared thereafter.
+_catalog = None
+
+
+def _load_catalog():
+    """ Return the packed constellation catalog as (names, offsets, table).
+
+    table is a structured array of _CONFIG_DTYPE records for all figures, concatenated
+    in alphabetical order of name, without XEphem's trailing [-1, 0, 0] end markers.
+    The records for names[i] are table[offsets[i]:offsets[i+1]].
+
+    The catalog is built the first time this is called and the same arrays are returned
+    on every later call, so callers must not modify them.
+    """
+    global _catalog
+    if _catalog is None:
+        data = _xephem_constellation_data()
+        names = tuple(sorted(data.keys()))
+        records = [data[name][:-1] for name in names]   # drop the end markers
+
+        offsets = np.zeros(len(names)+1, dtype=np.intp)
+        offsets[1:] = np.cumsum([len(r) for r in records])
+
+        table = np.empty(offsets[-1], dtype=_CONFIG_DTYPE)
+        flat = np.asarray([point for r in records for point in r])
+        table['drawcode'] = flat[:,0]
+        table['ra'] = flat[:,1]
+        table['dec'] = flat[:,2]
+
+        for a in (offsets, table):
+            a.flags.writeable = False
+        _catalog = (names, offsets, table)
+    return _catalog
+
+
+# Segment table, derived from the packed catalog by _segment_table()
+_SEGMENT_DTYPE = np.dtype([('ra1', np.float64), ('dec1', np.float64),
+                           ('ra2', np.float64), ('dec2', np.float64),
+                           ('drawcode', np.int8), ('figure', np.int16)])
+_segments = None
+
+
+def _segment_table():
+    """ Return every drawn stick figure segment as one structured array.
+
+    Each record holds the two endpoints in degrees, the drawcode (1 for a solid line,
+    2 for a dotted line) and the index of its constellation in the names tuple from
+    _load_catalog(). Built on first use and shared thereafter; do not modify.
+    """
+    global _segments
+    if _segments is None:
+        names, offsets, table = _load_catalog()
+        # every figure starts with a move, so the previous point is always in the same figure
+        end = np.nonzero(table['drawcode'] > 0)[0]
+        figure = np.repeat(np.arange(len(names)), np.diff(offsets))
+
+        segs = np.empty(len(end), dtype=_SEGMENT_DTYPE)
+        segs['ra1'] = table['ra'][end-1] * (15.0 / 1800)
+        segs['dec1'] = table['dec'][end-1] / 60.0
+        segs['ra2'] = table['ra'][end] * (15.0 / 1800)
+        segs['dec2'] = table['dec'][end] / 60.0
+        segs['drawcode'] = table['drawcode'][end]
+        segs['figure'] = figure[end]
+
+        segs.flags.writeable = False
+        _segments = segs
+    return _segments
+
+
+def _segment_vertices(segs):
+    """ Stack segment endpoints into the (N, 2, 2) vertex array used by LineCollection """
+    verts = np.empty((len(segs), 2, 2))
+    verts[:,0,0] = segs['ra1']
+    verts[:,0,1] = segs['dec1']
+    verts[:,1,0] = segs['ra2']
+    verts[:,1,1] = segs['dec2']
+    return verts
+
+
+def draw_segments(ax, verts, drawcodes, color='blue', **kwargs):
+    """ Draw segments into a 2D Axes, as one LineCollection of the solid segments (drawcode 1)
+    and one of the dotted segments (drawcode 2). verts is an (N, 2, 2) array of endpoints as
+    from project_segments(). Other keywords are passed to LineCollection. Returns both collections.
+    """
+    from matplotlib.collections import LineCollection
+    lines = []
+    for drawcode, linestyle in ((1, 'solid'), (2, 'dotted')):
+        collection = LineCollection(verts[drawcodes == drawcode], colors=color, linestyles=linestyle, **kwargs)
+        ax.add_collection(collection)
+        lines.append(collection)
+    return lines
+
+
+def constellations(plot=False, plot3d=False, color='blue', radius=None, greatcircles=True,
+        projection=None, center=(0., 0.), densify=None, ax=None):
     """ Plot constellation patterns, in 2D or 3D. 
 
     This does not provide extraordinarily high precision; it's just a cosmetic display that sketches out
@@ -17,16 +116,87 @@ def constellations(plot=False, plot3d=False, color='blue', radius=None, greatcir
     plot, plot3D : bool
         Draw constellations into current Axes in 2D, or 3D using mplot3d, respectively. 
         If neither of these is set, the constellation stick figure data will be returned as a dictionary.
+        In 2D, all the solid segments are drawn as one LineCollection and all the dotted
+        segments as a second one, and those two collections are returned. In 3D the
+        same is done with Line3DCollections, plus a third one for the great circles.
     color : Matplotlib color specification
         Color for the lines
     radius : float
         Only used for Mplot3d display, in which case it sets the radius of the sphere on which the constellations are drawn.
+        Defaults to 1.
     greatcircles : bool
         Draw major great circles such as celestial equator, 0 RA, etc.
+    projection : string
+        Only used for 2D display. By default RA and Dec are plotted directly; set this to
+        'gnomonic', 'aitoff', 'mollweide' or 'hammer' to draw in that projection instead,
+        using project_constellations().
+    center : tuple of floats
+        RA and Dec in degrees of the center of the projection.
+    densify : float
+        If set, draw each segment along its great circle arc, in pieces no longer than this
+        many degrees, rather than as a straight line between its endpoints.
+    ax : Matplotlib Axes
+        Axes to draw into, instead of the current Axes.
 
 
     """
-    
+
+    if plot is False and plot3d is False:
+        names, offsets, table = _load_catalog()
+        # Rebuild the XEphem-style dictionary of [drawcode, ra, dec] lists
+        constellation_data = dict()
+        for i, name in enumerate(names):
+            points = table[offsets[i]:offsets[i+1]]
+            constellation_data[name] = [list(p) for p in points.tolist()] + [[-1, 0, 0]]
+        return constellation_data
+
+    lines=[]
+    segs = _segment_table() if densify is None else _densified_table(densify)
+    if ax is None:
+        import pylab
+        ax = pylab.gca()
+    if plot:
+        if projection is None:
+            verts = _segment_vertices(segs)
+            drawcodes = segs['drawcode']
+        else:
+            verts, source = project_constellations(projection, center, densify=densify)
+            drawcodes = segs['drawcode'][source]
+        lines = draw_segments(ax, verts, drawcodes, color=color)
+        ax.autoscale_view()
+
+    elif plot3d:
+        from mpl_toolkits.mplot3d.art3d import Line3DCollection
+        if radius is None: radius = 1
+
+        # convert all the segment endpoints at once, to an (N, 2, 3) vertex array
+        ras = np.column_stack((segs['ra1'], segs['ra2']))
+        decs = np.column_stack((segs['dec1'], segs['dec2']))
+        verts = radec2xyz(radius, ras, decs, stacked=True)
+        for drawcode, linestyle in ((1, 'solid'), (2, 'dotted')):
+            collection = Line3DCollection(verts[segs['drawcode'] == drawcode], colors=color, linestyles=linestyle)
+            ax.add_collection3d(collection)
+            lines.append(collection)
+
+        if greatcircles:
+            # celestial equator and the 0 RA meridian
+            pts=45
+            ras = np.array([np.linspace(0,360,pts), np.zeros(pts)])
+            decs = np.array([np.zeros(pts), np.linspace(-90,90,pts)])
+            verts = radec2xyz(radius, ras, decs, stacked=True)
+            collection = Line3DCollection(verts, colors='black', linestyles=['solid', 'dotted'])
+            ax.add_collection3d(collection)
+            lines.append(collection)
+
+    return lines
+
+
+
+def _xephem_constellation_data():
+    """ Constellation stick figures from XEphem, as a dict of lists of ConFig records.
+
+    This rebuilds the full dictionary every time, so use _load_catalog() instead.
+    """
     constellation_data = dict()
     
     # The data structures containing the points for each constellation are as
@@ -1333,69 +1503,619 @@ def constellations(plot=False, plot3d=False, color='blue', radius=None, greatcir
         [-1,     0,    0]
     ]
 
-  
-    
-    for name, point_list in constellation_data.items():
-        points = np.asarray(point_list)
-        
-        drawtype = points[:,0]
-        ra_degrees = points[:,1] * 1.0 / 1800 * 15
-        dec_degrees = points[:,2] * 1.0 / 60
-        
-        
-        lines=[]
-        for i in range(0, len(drawtype)-1):
-            if drawtype[i] == 0:    
-                continue # don't draw lines, just move for type 0
-            if plot: 
-                lines.append( pylab.plot(  ra_degrees[i - 1:(i)+1], dec_degrees[i - 1:(i)+1], linestyle=':' if drawtype[i] ==2 else "-", color=color))
-            elif plot3d:
-                ras =  ra_degrees[i - 1:(i)+1]
-                decs = dec_degrees[i - 1:(i)+1]
-                xs, ys, zs = radec2xyz(radius, ras, decs)
-                ax = pylab.gca()
-                lines.append( ax.plot(xs, ys, zs, linestyle=':' if drawtype[i] ==2 else "-", color=color) )
-
-
-    if plot3d and greatcircles:
-        pts=45
-        xs, ys, zs = radec2xyz(radius, np.linspace(0,360,pts), np.zeros(pts))
-        lines.append( ax.plot(xs,ys,zs, linestyle='-', color='black'))
-
-        xs, ys, zs = radec2xyz(radius, np.zeros(pts), np.linspace(-90,90,pts))
-        lines.append( ax.plot(xs,ys,zs, linestyle=':', color='black'))
-     
-    if plot is False and plot3d is False: return constellation_data
-    else: return lines
-
-
-def radec2xyz(radius, ra, dec, degrees=True):
-    northpole = 90 if degrees else np.pi
-    return polrec3d(radius, northpole-dec, ra, degrees=degrees)
-
-
-def polrec(r, a, degrees=False):
-    """Convert 2-d polar coordinates to rectangular coordinates.
-    Based on IDL JHUAPL lib's polrec.pro
+    return constellation_data
+
+
+# Number of elements processed per step where the coordinate conversions need scratch space
+_CHUNK = 65536
+
+
+def _output_buffers(shape, n, out, dtype, stacked):
+    """ Set up n output arrays of the given shape, either separate or as the columns of one
+    (..., n) array, allocating them unless out is given. Returns the list of arrays and the
+    value to return to the caller, which is None if that should be a tuple of scalars. """
+    if out is None:
+        dtype = np.float64 if dtype is None else dtype
+        if stacked:
+            out = np.empty(tuple(shape) + (n,), dtype=dtype)
+        else:
+            out = tuple(np.empty(shape, dtype=dtype) for i in range(n))
+            if shape == ():
+                return list(out), None
+    if stacked:
+        return [out[..., i] for i in range(n)], out
+    return list(out), tuple(out)
+
+
+def _rows(shape):
+    """ Slices along the first axis covering about _CHUNK elements each """
+    if len(shape) == 0:
+        yield Ellipsis
+        return
+    rows = max(1, _CHUNK // max(1, int(np.prod(shape[1:]))))
+    for start in range(0, shape[0], rows):
+        yield slice(start, start+rows)
+
+
+def _polrec3d_kernel(radius, ax, cf, x, y, z):
+    """ Fill x, y, z with the rectangular form of radius, polar angle, azimuth, given the polar
+    angle in radians already in z and the azimuth ax in units of cf radians. Each of sin and
+    cos is evaluated once per angle, and scratch space is limited to _CHUNK elements. """
+    np.sin(z, out=x)
+    np.cos(z, out=z)
+    if radius is not None and not (np.isscalar(radius) and radius == 1):
+        np.multiply(z, radius, out=z)
+        np.multiply(x, radius, out=x)      # x now holds the cylindrical radius
+    np.multiply(ax, cf, out=y)
+
+    scratch = None
+    for rows in _rows(x.shape):
+        xr, yr = x[rows], y[rows]
+        if scratch is None or scratch.shape[0] < xr.shape[0]:
+            scratch = np.empty(xr.shape, dtype=x.dtype)
+        s = scratch[:xr.shape[0]] if xr.ndim else scratch
+        np.sin(yr, out=s)
+        np.cos(yr, out=yr)
+        np.multiply(s, xr, out=s)
+        np.multiply(xr, yr, out=xr)
+        yr[...] = s
+
+
+def radec2xyz(radius, ra, dec, degrees=True, out=None, dtype=None, stacked=False):
+    """Convert RA, Dec (and optionally radius) to rectangular coordinates.
 
+    Parameters
+    -----------
+    radius : float or array_like
+        Distance from the origin, or None for unit vectors
+    ra, dec : array_like
+        Spherical coordinates, in degrees unless degrees=False
+    out : tuple of 3 arrays, or array
+        Arrays to write x, y, z into, or with stacked=True a single (..., 3) array
+    dtype : numpy dtype
+        Type of the outputs if out is not given: float64 by default, or float32 to halve
+        the memory and time at the cost of precision
+    stacked : bool
+        Return a single (..., 3) array instead of a tuple of x, y, z arrays
+
+    Apart from the outputs, only a small fixed amount of scratch memory is used.
     """
-    cf = 1.e0
-    if degrees: cf = 180/np.pi
+    shape = np.broadcast(1 if radius is None else radius, ra, dec).shape
+    (x, y, z), result = _output_buffers(shape, 3, out, dtype, stacked)
 
-    x = r*np.cos(a/cf)
-    y = r*np.sin(a/cf)
-    return x, y
+    cf = np.pi/180 if degrees else 1.
+    northpole = 90 if degrees else np.pi/2
+    np.subtract(northpole, dec, out=z)
+    np.multiply(z, cf, out=z)
+    _polrec3d_kernel(radius, ra, cf, x, y, z)
+    return (x[()], y[()], z[()]) if result is None else result
+
+
+def xyz2radec(x, y=None, z=None, degrees=True, out=None, dtype=None):
+    """Convert rectangular coordinates to RA, Dec; the inverse of radec2xyz.
+
+    x, y, z may be given separately, or as a single (..., 3) array x. The vectors
+    need not be normalized. RA is returned in the range 0 to 360 degrees (2 pi radians).
+    out may be a tuple of two arrays to write RA and Dec into.
+    """
+    if y is None:
+        x, y, z = x[..., 0], x[..., 1], x[..., 2]
+    shape = np.broadcast(x, y, z).shape
+    (ra, dec), result = _output_buffers(shape, 2, out, dtype, False)
+
+    np.arctan2(y, x, out=ra)
+    np.add(ra, 2*np.pi, out=ra, where=ra < 0)
+    np.hypot(x, y, out=dec)
+    np.arctan2(z, dec, out=dec)
+    if degrees:
+        np.multiply(ra, 180/np.pi, out=ra)
+        np.multiply(dec, 180/np.pi, out=dec)
+    return (ra[()], dec[()]) if result is None else result
+
+
+def polrec(r, a, degrees=False, out=None, dtype=None):
+    """Convert 2-d polar coordinates to rectangular coordinates.
+    Based on IDL JHUAPL lib's polrec.pro
 
-def polrec3d(radius, az, ax, degrees=False):
+    out may be a tuple of two arrays to write x and y into; otherwise they are allocated
+    with the given dtype (float64 by default). No other temporary arrays are used.
+    """
+    shape = np.broadcast(r, a).shape
+    (x, y), result = _output_buffers(shape, 2, out, dtype, False)
+
+    cf = np.pi/180 if degrees else 1.
+    np.multiply(a, cf, out=x)
+    np.sin(x, out=y)
+    np.cos(x, out=x)
+    np.multiply(x, r, out=x)
+    np.multiply(y, r, out=y)
+    return (x[()], y[()]) if result is None else result
+
+def polrec3d(radius, az, ax, degrees=False, out=None, dtype=None, stacked=False):
     """Convert vector(s) from spherical polar to rectangular form.
         Based on IDL JHUAPL lib's polrec3d.pro
+
+    out, dtype and stacked are as for radec2xyz.
+    """
+    shape = np.broadcast(1 if radius is None else radius, az, ax).shape
+    (x, y, z), result = _output_buffers(shape, 3, out, dtype, stacked)
+
+    cf = np.pi/180 if degrees else 1.
+    np.multiply(az, cf, out=z)
+    _polrec3d_kernel(radius, ax, cf, x, y, z)
+    return (x[()], y[()], z[()]) if result is None else result
+
+
+def constellation_names():
+    """ Names of the constellations, in the order used by the 'figure' field of segment arrays """
+    return _load_catalog()[0]
+
+
+# Unit-vector geometry and KD-tree over the segment table, built by _segment_index(),
+# and RA, Dec bounding boxes of the segments, built by _segment_bounds()
+_index = None
+_bounds = None
+
+
+def _segment_index():
+    """ Return a dict of unit-vector geometry for every segment in _segment_table().
+
+    Keys are 'a', 'b' (endpoint unit vectors), 'pole' (unit normal of the great circle
+    through them), 'ua', 'ub' (vectors whose dot products with a point are both
+    non-negative iff the point projects inside the arc), 'halflen' (half the arc length,
+    radians) and 'tree', a scipy cKDTree over the arc midpoints.
+    """
+    global _index
+    if _index is None:
+        from scipy.spatial import cKDTree
+
+        segs = _segment_table()
+        a = radec2xyz(1, segs['ra1'], segs['dec1'], stacked=True)
+        b = radec2xyz(1, segs['ra2'], segs['dec2'], stacked=True)
+
+        pole = np.cross(a, b)
+        norm = np.sqrt((pole**2).sum(axis=1))
+        pole /= np.where(norm > 0, norm, 1)[:,np.newaxis]   # degenerate segments get a zero pole
+
+        mid = a + b
+        mid /= np.sqrt((mid**2).sum(axis=1))[:,np.newaxis]
+
+        _index = dict(a=a, b=b, pole=pole, ua=np.cross(pole, a), ub=np.cross(b, pole),
+                      halflen=np.arctan2(norm, (a*b).sum(axis=1)) / 2, tree=cKDTree(mid))
+    return _index
+
+
+def _arc_distance(p, index, sel=slice(None)):
+    """ Angular distance in radians from unit vector(s) p to the segment arcs index[...][sel].
+
+    p may be a single (3,) vector, giving one distance per segment, or an (M, 3) array,
+    giving an (M, nsegments) array.
+    """
+    a, b, pole = index['a'][sel], index['b'][sel], index['pole'][sel]
+    # cosine of the distance to the nearer endpoint
+    cosdist = np.maximum(np.dot(p, a.T), np.dot(p, b.T))
+    np.clip(cosdist, -1, 1, out=cosdist)
+    dist = np.arccos(cosdist)
+
+    # points which project onto the interior of the arc are closer to it than to either end
+    sindist = np.dot(p, pole.T)
+    inside = (np.dot(p, index['ua'][sel].T) >= 0) & (np.dot(p, index['ub'][sel].T) >= 0) & (index['halflen'][sel] > 0)
+    dist[inside] = np.arcsin(np.minimum(np.abs(sindist[inside]), 1))
+    return dist
+
+
+def segments_in_cone(ra, dec, radius):
+    """ Find the constellation segments which pass within a cone on the sky.
+
+    Parameters
+    -----------
+    ra, dec : float
+        Center of the cone, in degrees
+    radius : float
+        Radius of the cone, in degrees
+
+    Returns
+    --------
+    segs : structured ndarray
+        The matching rows of the segment table, with fields ra1, dec1, ra2, dec2 (degrees),
+        drawcode (1 solid, 2 dotted) and figure (index into constellation_names()).
+    """
+    index = _segment_index()
+    center = radec2xyz(1, ra, dec, stacked=True)
+    # any segment reaching the cone has its midpoint within radius + its half length
+    search = min(np.radians(radius) + index['halflen'].max(), np.pi)
+    candidates = np.asarray(index['tree'].query_ball_point(center, 2*np.sin(search/2)), dtype=np.intp)
+
+    hit = _arc_distance(center, index, candidates) <= np.radians(radius)
+    return _segment_table()[candidates[hit]]
+
+
+def _segment_bounds():
+    """ Return a dict of the RA, Dec bounding box of every segment in _segment_table(),
+    taking each as a straight line in RA, Dec going the short way around in RA: 'ra_lo'
+    and 'ra_span' (its start and width in RA) and 'dec_lo', 'dec_hi', all in degrees.
+    """
+    global _bounds
+    if _bounds is None:
+        segs = _segment_table()
+        dra = (segs['ra2'] - segs['ra1'] + 180.) % 360. - 180.
+        _bounds = {'ra_lo': np.where(dra >= 0, segs['ra1'], segs['ra2']) % 360.,
+                   'ra_span': np.abs(dra),
+                   'dec_lo': np.minimum(segs['dec1'], segs['dec2']),
+                   'dec_hi': np.maximum(segs['dec1'], segs['dec2'])}
+    return _bounds
+
+
+def segments_in_box(ra_min, ra_max, dec_min, dec_max):
+    """ Find the constellation segments which cross a rectangular RA, Dec box.
+
+    Segments are treated as straight lines in RA and Dec, as drawn by constellations(plot=True),
+    going the short way around in RA. The box may wrap through RA=0, in which case ra_min > ra_max.
+
+    Parameters
+    -----------
+    ra_min, ra_max, dec_min, dec_max : float
+        Edges of the box, in degrees
+
+    Returns
+    --------
+    segs : structured ndarray
+        The matching rows of the segment table; see segments_in_cone.
+    """
+    width = (ra_max - ra_min) % 360.
+    if width == 0: width = 360.
+
+    # candidates: segments whose RA, Dec bounding box overlaps the box. (A great circle
+    # cone around the box would miss straight RA, Dec lines that bow away near the poles.)
+    bounds = _segment_bounds()
+    near = (bounds['dec_lo'] <= dec_max) & (bounds['dec_hi'] >= dec_min)
+    near &= ((bounds['ra_lo'] - ra_min) % 360. <= width) | ((ra_min - bounds['ra_lo']) % 360. <= bounds['ra_span'])
+    segs = _segment_table()[near]
+
+    # Liang-Barsky clipping against the box, in RA measured from ra_min
+    x1 = (segs['ra1'] - ra_min) % 360.
+    dx = (segs['ra2'] - segs['ra1'] + 180.) % 360. - 180.
+    y1 = segs['dec1']
+    dy = segs['dec2'] - segs['dec1']
+    hit = np.zeros(len(segs), dtype=bool)
+    for shift in (0., -360.):       # the segment may reach the box after wrapping past 360
+        t0 = np.zeros(len(segs))
+        t1 = np.ones(len(segs))
+        ok = np.ones(len(segs), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, q in ((-dx, x1 + shift), (dx, width - x1 - shift), (-dy, y1 - dec_min), (dy, dec_max - y1)):
+                t = q / p
+                ok &= (p != 0) | (q >= 0)
+                t0 = np.where(p < 0, np.maximum(t0, t), t0)
+                t1 = np.where(p > 0, np.minimum(t1, t), t1)
+        hit |= ok & (t0 <= t1)
+    return segs[hit]
+
+
+def nearest_constellation(ra, dec, chunksize=1024):
+    """ Find the nearest constellation stick figure for each of many sky positions.
+
+    Distances are measured to the closest point on any segment's great circle arc. The
+    positions are processed chunksize at a time against the whole segment table, so
+    memory use is bounded by a few (chunksize x nsegments) arrays whatever the input size.
+
+    Parameters
+    -----------
+    ra, dec : array_like
+        Positions, in degrees
+    chunksize : int
+        Number of positions handled per vectorized step
+
+    Returns
+    --------
+    figure : ndarray of int16
+        Index into constellation_names() of the nearest figure, same shape as ra
+    distance : ndarray of float
+        Angular distance to that figure's nearest segment, in degrees
+    """
+    ra, dec = np.broadcast_arrays(np.asarray(ra, dtype=float), np.asarray(dec, dtype=float))
+    shape = ra.shape
+    ra = ra.ravel()
+    dec = dec.ravel()
+
+    index = _segment_index()
+    segs = _segment_table()
+    a, b, pole = index['a'], index['b'], index['pole']
+    arcs = index['halflen'] > 0
+
+    figure = np.empty(ra.size, dtype=segs['figure'].dtype)
+    distance = np.empty(ra.size)
+    for start in range(0, ra.size, chunksize):
+        chunk = slice(start, start+chunksize)
+        p = radec2xyz(1, ra[chunk], dec[chunk], stacked=True)
+        rows = np.arange(len(p))
+
+        # rank segments by the cosine of the distance to them
+        pa = np.dot(p, a.T)
+        pb = np.dot(p, b.T)
+        closeness = np.maximum(pa, pb)
+        sindist = np.dot(p, pole.T)
+        inside = (np.dot(p, index['ua'].T) >= 0) & (np.dot(p, index['ub'].T) >= 0) & arcs
+        np.copyto(closeness, np.sqrt(np.maximum(1 - sindist**2, 0)), where=inside)
+        best = closeness.argmax(axis=1)
+
+        # then measure the winners accurately
+        endpoint = np.where((pa[rows, best] >= pb[rows, best])[:,np.newaxis], a[best], b[best])
+        dist = np.arctan2(np.sqrt((np.cross(p, endpoint)**2).sum(axis=1)), (p*endpoint).sum(axis=1))
+        interior = inside[rows, best]
+        dist[interior] = np.arcsin(np.minimum(np.abs(sindist[rows, best][interior]), 1))
+
+        figure[chunk] = segs['figure'][best]
+        distance[chunk] = np.degrees(dist)
+    return figure.reshape(shape), distance.reshape(shape)
+
+
+# Densified copies of the segment table, keyed by step, built by _densified_table()
+_densified = dict()
+
+
+def densify_segments(segs, step=1.):
+    """ Interpolate segments along their great circle arcs.
+
+    Each segment is replaced by enough equal pieces of its arc that none is longer than
+    step degrees, computed for all segments at once by spherical linear interpolation.
+    The RAs of the pieces are continuous along each original segment, so they may run
+    outside 0-360 where a segment crosses RA=0.
+
+    Parameters
+    -----------
+    segs : structured ndarray
+        Segments with fields ra1, dec1, ra2, dec2 in degrees, such as the segment table.
+    step : float
+        Maximum length of the interpolated pieces, in degrees.
+
+    Returns
+    --------
+    pieces : structured ndarray
+        The pieces, with the same fields as segs; any other fields are copied from the
+        segment each piece came from.
+    """
+    a = radec2xyz(1, segs['ra1'], segs['dec1'], stacked=True)
+    b = radec2xyz(1, segs['ra2'], segs['dec2'], stacked=True)
+    theta = np.arctan2(np.sqrt((np.cross(a, b)**2).sum(axis=1)), (a*b).sum(axis=1))
+    npieces = np.maximum(np.ceil(np.degrees(theta) / step), 1).astype(np.intp)
+
+    parent = np.repeat(np.arange(len(segs)), npieces)
+    first = np.cumsum(npieces) - npieces
+    k = np.arange(parent.size) - first[parent]
+
+    def slerp(t):
+        th = theta[parent]
+        sin_th = np.sin(th)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wa = np.where(sin_th > 0, np.sin((1-t)*th) / sin_th, 1-t)
+            wb = np.where(sin_th > 0, np.sin(t*th) / sin_th, t)
+        return xyz2radec(wa[:,np.newaxis] * a[parent] + wb[:,np.newaxis] * b[parent])
+
+    ra_start, dec_start = slerp(k * 1.0 / npieces[parent])
+    ra_end, dec_end = slerp((k+1) * 1.0 / npieces[parent])
+
+    # make RA continuous along each segment, starting from its first endpoint
+    dra = (ra_end - ra_start + 180.) % 360. - 180.
+    cum = np.cumsum(dra)
+    ra_end = segs['ra1'][parent] + cum - (cum - dra)[first][parent]
+    ra_start = ra_end - dra
+
+    pieces = segs[parent]
+    pieces['ra1'], pieces['dec1'] = ra_start, dec_start
+    pieces['ra2'], pieces['dec2'] = ra_end, dec_end
+    return pieces
+
+
+def _densified_table(step):
+    """ Return densify_segments(_segment_table(), step), computed once per step and shared thereafter """
+    step = float(step)
+    if step not in _densified:
+        pieces = densify_segments(_segment_table(), step)
+        pieces.flags.writeable = False
+        _densified[step] = pieces
+    return _densified[step]
+
+
+_PROJECTIONS = ('gnomonic', 'aitoff', 'mollweide', 'hammer')
+
+# Recently used results of project_constellations(), most recent last
+_projection_cache = collections.OrderedDict()
+_PROJECTION_CACHE_SIZE = 32
+
+
+def _rotate_to_center(xyz, center):
+    """ Rotate unit vectors so that center (ra, dec in degrees) lies along +x, with north along +z """
+    ra0, dec0 = np.radians(center[0]), np.radians(center[1])
+    rot_z = np.array([[ np.cos(ra0), np.sin(ra0), 0],
+                      [-np.sin(ra0), np.cos(ra0), 0],
+                      [           0,           0, 1]])
+    rot_y = np.array([[ np.cos(dec0), 0, np.sin(dec0)],
+                      [            0, 1,            0],
+                      [-np.sin(dec0), 0, np.cos(dec0)]])
+    return np.dot(xyz, np.dot(rot_y, rot_z).T)
+
+
+def _chord_point(a, b, t):
+    """ Points at fraction t along the chords from a to b, which all lie on the great circle arcs """
+    return a + t[:,np.newaxis] * (b - a)
+
+
+def _bisect_boundary(a, b, t_out, t_in, visible, iterations=40):
+    """ Find where the arcs from a to b cross the edge of the visible region, by bisection
+    between chord fractions t_out (outside) and t_in (inside). Vectorized over all arcs. """
+    for i in range(iterations):
+        t = (t_out + t_in) / 2
+        inside = visible(_chord_point(a, b, t))
+        t_in = np.where(inside, t, t_in)
+        t_out = np.where(inside, t_out, t)
+    return t_in
+
+
+def _clip_to_cap(a, b, cos_horizon):
+    """ Clip arcs to the cap within the horizon angle of +x. Returns the clipped endpoints and
+    the indices of the arcs which survive. """
+    visible = lambda x: x[:,0] >= cos_horizon * np.sqrt((x**2).sum(axis=1))
+    vis_a = visible(a)
+    vis_b = visible(b)
+
+    # closest point of each arc to the center: the foot of the perpendicular if that lies on the arc,
+    # otherwise the nearer endpoint. Expressed as a chord fraction t_c.
+    ab = np.cross(a, b)
+    pole = ab / np.maximum(np.sqrt((ab**2).sum(axis=1)), 1e-300)[:,np.newaxis]
+    foot = -pole[:,0,np.newaxis] * pole
+    foot[:,0] += 1
+    interior = (np.cross(pole, a)[:,0] >= 0) & (np.cross(b, pole)[:,0] >= 0) & (np.abs(ab).sum(axis=1) > 0)
+    ta = (np.cross(foot, a) * -ab).sum(axis=1)
+    tb = (np.cross(foot, b) * ab).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_c = np.where(interior, ta / (ta + tb), np.where(a[:,0] >= b[:,0], 0., 1.))
+
+    keep = np.nonzero(vis_a | vis_b | visible(_chord_point(a, b, t_c)))[0]
+    a, b, t_c = a[keep], b[keep], t_c[keep]
+    vis_a, vis_b = vis_a[keep], vis_b[keep]
+
+    t_start = np.zeros(len(keep))
+    t_end = np.ones(len(keep))
+    if not vis_a.all():
+        t_start[~vis_a] = _bisect_boundary(a[~vis_a], b[~vis_a], t_start[~vis_a], t_c[~vis_a], visible)
+    if not vis_b.all():
+        t_end[~vis_b] = _bisect_boundary(a[~vis_b], b[~vis_b], t_end[~vis_b], t_c[~vis_b], visible)
+    return _chord_point(a, b, t_start), _chord_point(a, b, t_end), keep
+
+
+def _split_at_antimeridian(a, b):
+    """ Split arcs where they cross the antimeridian (y = 0, x < 0) of the rotated frame.
+    Returns start and end points, the longitude sign to force at each end (0 for none),
+    and the index of the arc each piece comes from. """
+    n = len(a)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = a[:,1] / (a[:,1] - b[:,1])
+    crosses = (a[:,1] * b[:,1] < 0)
+    crosses[crosses] = _chord_point(a[crosses], b[crosses], t[crosses])[:,0] < 0
+    c = np.nonzero(crosses)[0]
+    mid = _chord_point(a[c], b[c], t[c])
+
+    start = np.concatenate((a, mid))
+    end = np.concatenate((b, b[c]))
+    end[c] = mid
+    # the crossing point is at longitude +180 on the side of the piece's other end
+    sign_start = np.concatenate((np.zeros(n), np.sign(b[c,1])))
+    sign_end = np.zeros(n + len(c))
+    sign_end[c] = np.sign(a[c,1])
+    source = np.concatenate((np.arange(n), c))
+    return start, end, sign_start, sign_end, source
+
+
+def _lonlat(xyz, sign):
+    """ Longitude and latitude in radians of vectors, with longitude forced to sign*pi where sign != 0 """
+    lon = np.arctan2(xyz[:,1], xyz[:,0])
+    lon = np.where(sign != 0, sign * np.pi, lon)
+    lat = np.arctan2(xyz[:,2], np.sqrt(xyz[:,0]**2 + xyz[:,1]**2))
+    return lon, lat
+
+
+def _project_lonlat(projection, lon, lat):
+    """ Apply an all-sky projection to longitude, latitude in radians, returning x, y in degrees """
+    if projection == 'aitoff':
+        alpha = np.arccos(np.cos(lat) * np.cos(lon / 2))
+        sinc = np.where(alpha > 0, np.sin(alpha) / np.where(alpha > 0, alpha, 1), 1)
+        x = 2 * np.cos(lat) * np.sin(lon / 2) / sinc
+        y = np.sin(lat) / sinc
+    elif projection == 'hammer':
+        denom = np.sqrt(1 + np.cos(lat) * np.cos(lon / 2))
+        x = 2 * np.sqrt(2) * np.cos(lat) * np.sin(lon / 2) / denom
+        y = np.sqrt(2) * np.sin(lat) / denom
+    elif projection == 'mollweide':
+        # solve 2 theta + sin(2 theta) = pi sin(lat) by Newton's method, on u = 2 theta
+        u = 2 * lat
+        target = np.pi * np.sin(lat)
+        for i in range(30):
+            denom = 1 + np.cos(u)
+            u = np.where(denom > 1e-12, u - (u + np.sin(u) - target) / np.where(denom > 1e-12, denom, 1), u)
+        theta = u / 2
+        x = 2 * np.sqrt(2) / np.pi * lon * np.cos(theta)
+        y = np.sqrt(2) * np.sin(theta)
+    return np.degrees(x), np.degrees(y)
+
+
+def project_segments(segs, projection, center=(0., 0.), horizon=60.):
+    """ Project segments on the sky into one of several map projections.
+
+    All segments are handled together, as arrays. For the all-sky projections, segments
+    which cross the longitude 180 degrees from the center are split in two there; for the
+    gnomonic projection, segments are clipped where they leave the cap within horizon degrees
+    of the center. Segments are drawn as straight lines between their projected endpoints.
+
+    Parameters
+    -----------
+    segs : structured ndarray
+        Segments with fields ra1, dec1, ra2, dec2 in degrees, such as those returned by
+        segments_in_cone().
+    projection : string
+        One of 'gnomonic', 'aitoff', 'mollweide' or 'hammer'.
+    center : tuple of floats
+        RA and Dec in degrees of the center of the projection.
+    horizon : float
+        For the gnomonic projection, the largest angle from the center to draw, in degrees.
+
+    Returns
+    --------
+    verts : ndarray
+        (N, 2, 2) array of projected segment endpoints, suitable for a LineCollection.
+        Coordinates are in degrees, with x increasing to the east; invert the x axis
+        for the usual east-left orientation.
+    source : ndarray
+        For each projected segment, the index of the input segment it came from.
+    """
+    if projection not in _PROJECTIONS:
+        raise ValueError("projection must be one of {%s}" % ", ".join(_PROJECTIONS))
+
+    a = radec2xyz(1, segs['ra1'], segs['dec1'], stacked=True)
+    b = radec2xyz(1, segs['ra2'], segs['dec2'], stacked=True)
+    a = _rotate_to_center(a, center)
+    b = _rotate_to_center(b, center)
+
+    if projection == 'gnomonic':
+        a, b, source = _clip_to_cap(a, b, np.cos(np.radians(horizon)))
+        verts = np.empty((len(source), 2, 2))
+        for i, p in enumerate((a, b)):
+            verts[:,i,0] = np.degrees(p[:,1] / p[:,0])
+            verts[:,i,1] = np.degrees(p[:,2] / p[:,0])
+    else:
+        start, end, sign_start, sign_end, source = _split_at_antimeridian(a, b)
+        verts = np.empty((len(source), 2, 2))
+        for i, (p, sign) in enumerate(((start, sign_start), (end, sign_end))):
+            verts[:,i,0], verts[:,i,1] = _project_lonlat(projection, *_lonlat(p, sign))
+    return verts, source
+
+
+def project_constellations(projection, center=(0., 0.), horizon=60., densify=None):
+    """ Project all the constellation segments, caching the result.
+
+    Same as project_segments(_segment_table(), ...), except that the results for the most
+    recently used combinations of projection, center, horizon and densify are kept, so that
+    repeated charts with the same setup are free. The returned arrays are shared, and read-only.
+    The source indices refer to rows of the full segment table, or if densify is set to a
+    step in degrees, to the rows of the table densified with that step by densify_segments().
     """
-    z, rxy = polrec(radius, az, degrees=degrees)
-    x, y   = polrec(rxy, ax, degrees=degrees)
-    return x, y, z
+    key = (projection, float(center[0]), float(center[1]), float(horizon) if projection == 'gnomonic' else None,
+           None if densify is None else float(densify))
+    if key in _projection_cache:
+        result = _projection_cache.pop(key)
+    else:
+        segs = _segment_table() if densify is None else _densified_table(densify)
+        result = project_segments(segs, projection, center=center, horizon=horizon)
+        for a in result:
+            a.flags.writeable = False
+        if len(_projection_cache) >= _PROJECTION_CACHE_SIZE:
+            _projection_cache.popitem(last=False)
+    _projection_cache[key] = result
+    return result
 
 
 def demo3d(ax=None, radius=1):
+    import pylab
     from mpl_toolkits.mplot3d import Axes3D
     
     for i in range(3):
@@ -0,0 +1,70 @@
+"""
+Friends-of-friends grouping of positions on the sky.
+
+Two positions are friends if they are within the linking length of each other, and a
+group is everything connected by a chain of friends. The pairs of friends are found with
+a KD-tree over unit vectors (scipy.spatial.cKDTree), and merged into groups with an
+array-based union-find, so the cost scales as about O(N log N).
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from gcirc import _to_radians, _angle_scale, _unit_vectors
+
+
+def _union(parent, i, j):
+    """ Merge the sets containing each pair i, j in the union-find forest parent, in place.
+    On entry and exit every element of parent points directly at the root of its set,
+    which is always the smallest index in the set. """
+    while True:
+        lo = np.minimum(parent[i], parent[j])
+        hi = np.maximum(parent[i], parent[j])
+        merge = lo != hi
+        if not merge.any():
+            return parent
+        i, j = i[merge], j[merge]
+        # hook each larger root under the smaller one, then compress paths until flat again
+        np.minimum.at(parent, hi[merge], lo[merge])
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all(): break
+            parent[:] = grandparent
+
+
+def friends_of_friends(ra, dc, linking_length, units_in='degrees', units_out='arcsec', chunksize=1000000):
+    """ Group positions on the sky by friends-of-friends.
+
+    Parameters
+    ----------
+    ra, dc : array_like
+        Positions; each is flattened
+    linking_length : float
+        Largest separation between friends, in units_out
+    units_in, units_out : string
+        As for gcirc: the units of the positions, and of the linking length
+    chunksize : int
+        Number of positions whose friends are found at a time, to bound memory use
+
+    Returns
+    -------
+    group : ndarray of int
+        Group number of each position, from 0 to ngroups-1 in order of each group's
+        first member. Isolated positions are groups of one.
+    """
+    rarad, dcrad = _to_radians(np.ravel(ra), np.ravel(dc), units_in)
+    xyz = _unit_vectors(*np.broadcast_arrays(rarad, dcrad))
+    angle = min(linking_length * _angle_scale(units_out), np.pi)
+    chord = 2 * np.sin(angle / 2) * (1 + 1e-12)
+
+    tree = cKDTree(xyz)
+    parent = np.arange(len(xyz))
+    for start in range(0, len(xyz), chunksize):
+        pairs = cKDTree(xyz[start:start+chunksize]).sparse_distance_matrix(tree, chord, output_type='ndarray')
+        i = pairs['i'].astype(np.intp) + start
+        j = pairs['j'].astype(np.intp)
+        keep = (i < j) & (2 * np.arcsin(np.minimum(pairs['v'] / 2, 1)) <= angle)
+        _union(parent, i[keep], j[keep])
+
+    # roots are the smallest members, so this numbers the groups by first appearance
+    roots, group = np.unique(parent, return_inverse=True)
+    return group.reshape(-1)
@@ -1,6 +1,136 @@
 import numpy as np
 
-def gcirc(ra1, dc1, ra2, dc2, units_in='degrees', units_out='arcsec'):
+d2r = np.pi / 180.0
+as2r = np.pi / 648000
+h2r = np.pi / 12.
+
+
+def _to_radians(ra, dc, units_in):
+    """ Convert RA, Dec in units_in to double precision radians """
+    if units_in == 'radians':
+        return np.asarray(ra, dtype=np.float64), np.asarray(dc, dtype=np.float64)
+    elif units_in == 'hours':    
+        return np.asarray(ra, dtype=np.float64) * h2r, np.asarray(dc, dtype=np.float64) * d2r
+    elif units_in == 'degrees':    
+        return np.asarray(ra, dtype=np.float64) * d2r, np.asarray(dc, dtype=np.float64) * d2r
+    else:    
+        raise ValueError("units_in must be one of {radians, hours, degrees} to define the units for RA.")
+
+
+def _unit_vectors(rarad, dcrad):
+    """ (N, 3) array of unit vectors toward RA, Dec in radians """
+    cosdc = np.cos(dcrad)
+    return np.column_stack((cosdc * np.cos(rarad), cosdc * np.sin(rarad), np.sin(dcrad)))
+
+
+def _angle_scale(units_out):
+    """ Number of radians per unit of distance in units_out """
+    if units_out =='arcsec':
+        return as2r
+    elif units_out =='degrees':
+        return d2r
+    elif units_out == 'radians':
+        return 1.0
+    else:
+        raise ValueError('units_out must be one of {radians, degrees, arcsec}')
+
+
+def _from_radians(dis, units_out):
+    """ Convert a distance in radians to units_out """
+    scale = _angle_scale(units_out)
+    return dis if scale == 1.0 else dis / scale
+
+
+class SkyVector(object):
+    """ Positions on the sky in a form ready for fast repeated separation and position angle
+    calculations: unit vectors, plus the sines and cosines of RA and Dec.
+
+    gcirc and posang accept a SkyVector in place of any RA, Dec pair of arguments, and then
+    compute with dot and cross products instead of re-evaluating the trig functions of that
+    position on every call. This is worthwhile for a reference catalog that is queried many
+    times, and is numerically stable at both small and large angles.
+
+    Parameters
+    ----------
+    ra, dc : array_like
+        Positions, in units_in
+    units_in : string
+        As for gcirc
+
+    Attributes
+    ----------
+    xyz : ndarray
+        (..., 3) unit vectors
+    ra, dc : ndarray
+        RA and Dec in radians
+    sinra, cosra, sindc, cosdc : ndarray
+        Their sines and cosines
+    """
+    def __init__(self, ra, dc, units_in='degrees'):
+        ra, dc = np.broadcast_arrays(*_to_radians(ra, dc, units_in))
+        self.ra, self.dc = ra, dc
+        self.sinra, self.cosra = np.sin(ra), np.cos(ra)
+        self.sindc, self.cosdc = np.sin(dc), np.cos(dc)
+        self.xyz = np.stack((self.cosdc * self.cosra, self.cosdc * self.sinra, self.sindc), axis=-1)
+
+    @classmethod
+    def from_xyz(cls, xyz):
+        """ Make a SkyVector from (..., 3) rectangular coordinates, such as from radec2xyz
+        with stacked=True. The vectors need not be normalized. """
+        xyz = np.asarray(xyz, dtype=np.float64)
+        self = cls.__new__(cls)
+        self.xyz = xyz / np.sqrt((xyz**2).sum(axis=-1))[..., np.newaxis]
+        x, y, z = self.xyz[..., 0], self.xyz[..., 1], self.xyz[..., 2]
+        rxy = np.hypot(x, y)
+        self.ra = np.arctan2(y, x)
+        self.dc = np.arctan2(z, rxy)
+        self.sindc, self.cosdc = z, rxy
+        self.sinra = np.where(rxy > 0, y / np.where(rxy > 0, rxy, 1), 0.)
+        self.cosra = np.where(rxy > 0, x / np.where(rxy > 0, rxy, 1), 1.)
+        return self
+
+    def __len__(self):
+        return len(self.ra)
+
+    def __getitem__(self, index):
+        result = self.__class__.__new__(self.__class__)
+        for name in ('ra', 'dc', 'sinra', 'cosra', 'sindc', 'cosdc'):
+            setattr(result, name, getattr(self, name)[index])
+        result.xyz = self.xyz[index]
+        return result
+
+
+def _sky_vector_args(args, units_in):
+    """ If any of the position arguments (ra1, dc1, ra2, dc2) is a SkyVector, return the two
+    positions as SkyVectors, converting an RA, Dec pair if necessary. Otherwise return None.
+    Raises TypeError if a position is missing, i.e. given as None. """
+    if not any(isinstance(a, SkyVector) for a in args):
+        if any(a is None for a in args):
+            raise TypeError('both positions must be given, as RA, Dec or as a SkyVector')
+        return None
+    args = list(args)
+    positions = []
+    while len(positions) < 2:
+        a = args.pop(0)
+        if not isinstance(a, SkyVector):
+            a = (a, args.pop(0))
+            if a[0] is None or a[1] is None:
+                raise TypeError('both positions must be given, as RA, Dec or as a SkyVector')
+            a = SkyVector(a[0], a[1], units_in)
+        positions.append(a)
+    return positions
+
+
+def _vector_separation(p1, p2):
+    """ Angle in radians between SkyVectors, from the atan2 of the cross and dot products """
+    x1, y1, z1 = p1.xyz[..., 0], p1.xyz[..., 1], p1.xyz[..., 2]
+    x2, y2, z2 = p2.xyz[..., 0], p2.xyz[..., 1], p2.xyz[..., 2]
+    sin = np.sqrt((y1*z2 - z1*y2)**2 + (z1*x2 - x1*z2)**2 + (x1*y2 - y1*x2)**2)
+    cos = x1*x2 + y1*y2 + z1*z2
+    return np.arctan2(sin, cos)
+
+
+def gcirc(ra1, dc1, ra2=None, dc2=None, units_in='degrees', units_out='arcsec'):
     """
     Ported from IDL gcirc.pro by Marshall Perrin
     
@@ -63,47 +193,156 @@ def gcirc(ra1, dc1, ra2, dc2, units_in='degrees', units_out='arcsec'):
           Use double precision for U=0 as advertised R. McMahon/W.L.  April 2007
           Use havesine formula, which has less roundoff error in the
                  milliarcsecond regime      W.L. Mar 2009
+
+     SKYVECTOR INPUTS:
+           Either position (RA1, DC1 or RA2, DC2) may be given as a single
+           SkyVector instead, e.g. gcirc(sv1, sv2) or gcirc(sv1, ra2, dc2).
+           The distance is then computed from the unit vectors.
     """
 
+    positions = _sky_vector_args((ra1, dc1, ra2, dc2), units_in)
+    if positions is not None:
+        return _from_radians(_vector_separation(*positions), units_out)
     
-    d2r = np.pi / 180.0
-    as2r = np.pi / 648000
-    h2r = np.pi / 12.
-    
-    # Convert input to double precision radians
-    if units_in == 'radians':
-        rarad1 = numpy.asarray(ra1, dtype=float64)
-        rarad2 = numpy.asarray(ra2, dtype=float64)
-        dcrad1 = numpy.asarray(dc1, dtype=float64)
-        dcrad2 = numpy.asarray(dc2, dtype=float64)
-    elif units_in == 'hours':    
-        rarad1 = ra1 * h2r
-        rarad2 = ra2 * h2r
-        dcrad1 = dc1 * d2r
-        dcrad2 = dc2 * d2r
-    elif units_in == 'degrees':    
-        rarad1 = ra1 * d2r
-        rarad2 = ra2 * d2r
-        dcrad1 = dc1 * d2r
-        dcrad2 = dc2 * d2r
-    else:    
-        raise ValueError("units_in must be one of {radians, hours, degrees} to define the units for RA.")
-    
+    rarad1, dcrad1 = _to_radians(ra1, dc1, units_in)
+    rarad2, dcrad2 = _to_radians(ra2, dc2, units_in)
     
     deldec2 = (dcrad2 - dcrad1) / 2.0
     delra2 = (rarad2 - rarad1) / 2.0
     sindis = np.sqrt(np.sin(deldec2) * np.sin(deldec2) + np.cos(dcrad1) * np.cos(dcrad2) * np.sin(delra2) * np.sin(delra2))
     dis = 2.0 * np.arcsin(sindis)
     
-    if units_out =='arcsec':
-        dis = dis / as2r
-    elif units_out =='degrees':
-        dis = dis / d2r
-    elif units_out == 'radians':
-        pass
-    else:
-        raise ValueError('units_out must be one of {radians, degrees, arcsec}')
-    
-    return dis
+    return _from_radians(dis, units_out)
+
+
+
+
+class _Catalog(object):
+    """ RA, Dec in radians of one catalog, with cos(Dec) computed once for all blocks """
+    def __init__(self, ra, dc, units_in):
+        ra, dc = _to_radians(ra, dc, units_in)
+        self.ra, self.dc = np.broadcast_arrays(np.ravel(ra), np.ravel(dc))
+        self.cosdc = np.cos(self.dc)
+
+
+def _haversine_block(cat1, rows, cat2, cols=slice(None)):
+    """ sin^2(distance/2) between cat1[rows] and cat2[cols], as a (nrows, ncols) block,
+    evaluated in place with one scratch array of the same size """
+    hav = np.subtract.outer(cat1.dc[rows], cat2.dc[cols])
+    hav *= 0.5
+    np.sin(hav, out=hav)
+    hav *= hav
+    scratch = np.subtract.outer(cat1.ra[rows], cat2.ra[cols])
+    scratch *= 0.5
+    np.sin(scratch, out=scratch)
+    scratch *= scratch
+    scratch *= cat1.cosdc[rows, np.newaxis]
+    scratch *= cat2.cosdc[cols]
+    hav += scratch
+    return hav
+
+
+def _haversine_to_angle(hav):
+    """ Convert sin^2(distance/2) to distance in radians, in place """
+    np.sqrt(hav, out=hav)
+    np.minimum(hav, 1, out=hav)
+    np.arcsin(hav, out=hav)
+    hav *= 2.0
+    return hav
+
+
+def gcirc_blocks(ra1, dc1, ra2, dc2, units_in='degrees', units_out='arcsec', max_bytes=64*2**20):
+    """ Great circle distances between all pairs of two catalogs, one block at a time.
+
+    Yields (rows, block) for successive slices rows of catalog 1, where block is the
+    (nrows, len(catalog 2)) array of distances from ra1[rows], dc1[rows] to every position
+    of catalog 2, as gcirc would compute them. Memory use is about max_bytes, whatever the
+    sizes of the catalogs. cos(dec) is computed just once for each catalog.
+
+    Parameters
+    ----------
+    ra1, dc1, ra2, dc2 : array_like
+        Positions of the two catalogs; each is flattened
+    units_in, units_out : string
+        As for gcirc
+    max_bytes : int
+        Approximate memory limit for the working arrays of each block
+    """
+    scale = _angle_scale(units_out)
+    cat1 = _Catalog(ra1, dc1, units_in)
+    cat2 = _Catalog(ra2, dc2, units_in)
+    nrows = max(1, max_bytes // (2 * 8 * max(1, cat2.ra.size)))
+    for start in range(0, cat1.ra.size, nrows):
+        rows = slice(start, min(start+nrows, cat1.ra.size))
+        block = _haversine_to_angle(_haversine_block(cat1, rows, cat2))
+        if scale != 1.0: block /= scale
+        yield rows, block
+
+
+def gcirc_pairs(ra1, dc1, ra2, dc2, threshold, units_in='degrees', units_out='arcsec', max_bytes=64*2**20):
+    """ All pairs from two catalogs which are within a threshold distance, in sparse COO form.
+
+    Catalog 2 is sorted by declination, so that each block of catalog 1 is only compared
+    with the band of catalog 2 that it could match. Blocks are sized to keep the working
+    arrays under about max_bytes.
+
+    Parameters
+    ----------
+    ra1, dc1, ra2, dc2 : array_like
+        Positions of the two catalogs; each is flattened
+    threshold : float
+        Largest distance to report, in units_out
+    units_in, units_out : string
+        As for gcirc
+    max_bytes : int
+        Approximate memory limit for the working arrays of each block
+
+    Returns
+    -------
+    i, j : ndarray
+        Indices into catalog 1 and catalog 2 of each pair, sorted by i then j
+    dis : ndarray
+        Distance of each pair, in units_out
+
+    These can be passed straight to scipy.sparse.coo_matrix((dis, (i, j))).
+    """
+    scale = _angle_scale(units_out)
+    thresh = float(threshold) * scale
+    cat1 = _Catalog(ra1, dc1, units_in)
+    cat2 = _Catalog(ra2, dc2, units_in)
+
+    order1 = np.argsort(cat1.dc, kind='mergesort')
+    order2 = np.argsort(cat2.dc, kind='mergesort')
+    for cat, order in ((cat1, order1), (cat2, order2)):
+        cat.ra, cat.dc, cat.cosdc = cat.ra[order], cat.dc[order], cat.cosdc[order]
+
+    # band of catalog 2 which each row of catalog 1 could match
+    lo = np.searchsorted(cat2.dc, cat1.dc - thresh, side='left')
+    hi = np.searchsorted(cat2.dc, cat1.dc + thresh, side='right')
+    max_elements = max(1, max_bytes // (2 * 8))
+    hav_thresh = np.sin(min(thresh, np.pi) / 2)**2
 
+    found_i, found_j, found_dis = [], [], []
+    start = 0
+    n1 = cat1.ra.size
+    while start < n1:
+        # grow the block while its band of catalog 2 keeps it within budget
+        stop = start + 1
+        while stop < n1:
+            trial = min(start + 2*(stop-start), n1)
+            if (trial-start) * (hi[trial-1] - lo[start]) > max_elements: break
+            stop = trial
+        cols = slice(lo[start], hi[stop-1])
+        if cols.stop > cols.start:
+            hav = _haversine_block(cat1, slice(start, stop), cat2, cols)
+            r, c = np.nonzero(hav <= hav_thresh)
+            found_i.append(order1[start + r])
+            found_j.append(order2[cols.start + c])
+            found_dis.append(_haversine_to_angle(hav[r, c]) / scale)
+        start = stop
 
+    if not found_i:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+    i, j, dis = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_dis)
+    order = np.lexsort((j, i))
+    return i[order], j[order], dis[order]
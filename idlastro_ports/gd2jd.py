@@ -6,10 +6,11 @@ Functions for handling dates.
 
 Contains:
    gd2jd  -- converts gregorian date to julian date
-   jd2gd  -- converts julian date to gregorian date
+   jd2gd  -- converts julian dates to gregorian dates
+   gd2jd_array -- converts arrays of gregorian dates to julian dates
+   isot2jd -- converts arrays of ISO-8601 / FITS DATE-OBS strings to julian dates
 
-Wish list:
-   Function to convert heliocentric julian date!
+Heliocentric julian dates are computed by helio_jd.helio_jd.
 
 
 
@@ -22,68 +23,65 @@ please do not remove my name from it." --E. Middleberg
 """
 
 # 2009-02-15 13:12 IJC: Converted to importable function
+from __future__ import print_function
+import numpy as np
 
+# fields of a structured array of calendar dates
+CALENDAR_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+CALENDAR_DTYPE = np.dtype([('year', np.int64), ('month', np.int64), ('day', np.int64),
+                           ('hour', np.int64), ('minute', np.int64), ('second', np.float64)])
 
-def jd2gd(jd):
+
+def jd2gd(jd, jd2=0.0, datetime64=False):
 
     """Task to convert a list of julian dates to gregorian dates
     description at http://mathforum.org/library/drmath/view/51907.html
     Original algorithm in Jean Meeus, "Astronomical Formulae for
     Calculators"
 
-    2009-02-15 13:36 IJC: Converted to importable, callable function
-    """
-    
-    jd=jd+0.5
-    Z=int(jd)
-    F=jd-Z
-    alpha=int((Z-1867216.25)/36524.25)
-    A=Z + 1 + alpha - int(alpha/4)
-
-    B = A + 1524
-    C = int( (B-122.1)/365.25)
-    D = int( 365.25*C )
-    E = int( (B-D)/30.6001 )
-
-    dd = B - D - int(30.6001*E) + F
+    jd may be a scalar or an array, optionally with the second part of a
+    two-part JD in jd2 (as returned by gd2jd_array with two_part set).
+    Returns a structured array of dtype CALENDAR_DTYPE, with fields year,
+    month, day, hour, minute and second, of the shape of jd; or, if
+    datetime64 is set, an array of numpy datetime64[us].
 
-    if E<13.5: mm=E-1
+    As in Meeus, dates before 1582 October 15 are in the Julian calendar
+    (the datetime64 values are always proleptic Gregorian).
 
-    if E>13.5: mm=E-13
-
-    if mm>2.5: yyyy=C-4716
-
-    if mm<2.5: yyyy=C-4715
-
-    months=["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-    daylist=[31,28,31,30,31,30,31,31,30,31,30,31]
-    daylist2=[31,29,31,30,31,30,31,31,30,31,30,31]
-
-    h=int((dd-int(dd))*24)
-    min=int((((dd-int(dd))*24)-h)*60)
-    sec=86400*(dd-int(dd))-h*3600-min*60
-
-    # Now calculate the fractional year. Do we have a leap year?
-    if (yyyy%4 != 0): days=daylist2
-    elif (yyyy%400 == 0): days=daylist2
-    elif (yyyy%100 == 0): days=daylist
-    else: days=daylist2
+    2009-02-15 13:36 IJC: Converted to importable, callable function
+    Vectorized with numpy, returning the dates instead of printing them
+    """
 
-    hh = 24.0*(dd % 1.0)
-    min = 60.0*(hh % 1.0)
-    sec = 60.0*(min % 1.0)
+    jd = np.asarray(jd, dtype=np.float64) + 0.5
+    Z = np.floor(jd)
+    F = (jd - Z) + jd2
+    carry = np.floor(F)
+    Z = (Z + carry).astype(np.int64)
+    F = F - carry
 
-    dd =  dd-(dd%1.0)
-    hh =  hh-(hh%1.0)
-    min =  min-(min%1.0)
+    if datetime64:
+        us = np.round(F * 86400e6).astype(np.int64)
+        return ((Z - 2440588) * 86400000000 + us).astype('datetime64[us]')
 
+    alpha = (Z - 1867216.25) // 36524.25
+    A = np.where(Z >= 2299161, Z + 1 + alpha - alpha // 4, Z)
 
-    print str(jd)+" = "+str(months[mm-1])+ ',' + str(dd) +',' +str(yyyy)
-    print string.zfill(h,2)+":"+string.zfill(min,2)+":"+string.zfill(sec,2)+" UTC"
+    B = A + 1524
+    C = ((B - 122.1) // 365.25).astype(np.int64)
+    D = (365.25 * C).astype(np.int64)
+    E = ((B - D) // 30.6001).astype(np.int64)
 
-    print (yyyy, mm, dd, hh, min, sec)
+    dates = np.empty(np.shape(Z), dtype=CALENDAR_DTYPE)
+    dates['day'] = B - D - (30.6001 * E).astype(np.int64)
+    dates['month'] = np.where(E < 14, E - 1, E - 13)
+    dates['year'] = np.where(dates['month'] > 2, C - 4716, C - 4715)
 
-    return
+    seconds = F * 86400.0
+    dates['hour'] = seconds // 3600
+    seconds -= dates['hour'] * 3600
+    dates['minute'] = seconds // 60
+    dates['second'] = seconds - dates['minute'] * 60
+    return dates
 
 
 def gd2jd(*date): #, verbose=False):
@@ -103,14 +101,14 @@ def gd2jd(*date): #, verbose=False):
     of the date should be float)
     """
     verbose=False
-    if verbose: print date
+    if verbose: print(date)
     #print date[0]
     #date = date[0]
 
     date = list(date)
 
     if len(date)<3:
-        print "You must enter a date of the form (2009, 02, 25)!"
+        print("You must enter a date of the form (2009, 02, 25)!")
         return -1
     elif len(date)==3:
         for ii in range(3): date.append(0)
@@ -164,11 +162,11 @@ def gd2jd(*date): #, verbose=False):
     else:
         fracyear=yyyy+daysum/365
     if verbose: 
-        print yyyy,mm,dd,hh,min,sec
-        print "UT="+`UT`
-        print "Fractional day: %f" % fracday
-        print "\n"+months[mm-1]+" %i, %i, %i:%i:%i UT = JD %f" % (dd, yyyy, hh, min, sec, JD),
-        print " = " + `fracyear`+"\n"
+        print(yyyy,mm,dd,hh,min,sec)
+        print("UT="+repr(UT))
+        print("Fractional day: %f" % fracday)
+        print("\n"+months[mm-1]+" %i, %i, %i:%i:%i UT = JD %f" % (dd, yyyy, hh, min, sec, JD), end=' ')
+        print(" = " + repr(fracyear)+"\n")
     # print dd,mm,yyyy, hh,min,sec, UT
 
 
@@ -176,3 +174,210 @@ def gd2jd(*date): #, verbose=False):
     return JD
 
 
+def _day_number(year, month, day):
+    """ Julian day number (the JD at noon) of integer Gregorian calendar dates, by integer
+    floor division, valid for all dates in the proleptic Gregorian calendar """
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    return day + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 - 32045
+
+
+def gd2jd_array(year, month=None, day=None, hour=0, minute=0, second=0, two_part=False):
+    """ Julian dates of arrays of UT Gregorian calendar dates.
+
+    The vectorized counterpart of gd2jd, for whole columns of dates at once.
+
+    Parameters
+    ----------
+    year, month, day : array_like
+        Calendar dates. Year and month are integers; day may have a fractional part.
+        Alternatively, year may be a structured array with the fields of
+        CALENDAR_FIELDS (hour, minute and second are optional), and the other
+        arguments are omitted.
+    hour, minute, second : array_like
+        Time of day, may be fractional; broadcast against the dates
+    two_part : bool
+        If set, return the JD as two arrays (jd1, jd2): jd1 is the JD at 0h of the date,
+        a whole number plus one half, and jd2 is the fraction of the day. Their sum is
+        the JD, but together they keep full precision in the time of day.
+
+    Returns
+    -------
+    jd : ndarray of float64, or (jd1, jd2) if two_part is set
+    """
+    if month is None:
+        dates = np.asarray(year)
+        if dates.dtype.names is None:
+            raise ValueError('Give year, month and day, or a structured array of dates')
+        fields = [dates[name] if name in dates.dtype.names else 0 for name in CALENDAR_FIELDS]
+        year, month, day, hour, minute, second = fields
+
+    day = np.asarray(day)
+    whole_day = np.floor(day)
+    jd1 = _day_number(np.asarray(year, dtype=np.int64), np.asarray(month, dtype=np.int64),
+                      whole_day.astype(np.int64)) - 0.5
+    jd2 = (day - whole_day) + (np.asarray(hour, dtype=np.float64) * 3600.0
+                              + np.asarray(minute, dtype=np.float64) * 60.0
+                              + np.asarray(second, dtype=np.float64)) / 86400.0
+    jd1, jd2 = np.broadcast_arrays(jd1, jd2)
+    if two_part:
+        return jd1, jd2
+    return jd1 + jd2
+
+
+def _text_columns(dates):
+    """ 2-d uint8 array of the characters of each date string, one row per date.
+    dates is an array of str or bytes, or a buffer of newline-terminated lines all of
+    the same length (bytes, bytearray, or a uint8 array such as a numpy.memmap). """
+    if isinstance(dates, (bytes, bytearray, memoryview)) or \
+            (isinstance(dates, np.ndarray) and dates.dtype == np.uint8):
+        buf = np.frombuffer(dates, dtype=np.uint8) if not isinstance(dates, np.ndarray) else dates.ravel()
+        if len(buf) == 0:
+            return np.zeros((0, 0), dtype=np.uint8)
+        newlines = np.flatnonzero(buf == ord('\n'))
+        if len(newlines) == 0 or newlines[-1] != len(buf) - 1:
+            newlines = np.append(newlines, len(buf))
+            buf = np.append(buf, np.uint8(ord('\n')))
+        width = newlines[0] + 1
+        if np.any(np.diff(newlines) != width) or len(buf) != width * len(newlines):
+            raise ValueError('lines of the buffer must all have the same length')
+        # the newline (and any carriage return) just becomes padding at the end of a row
+        return buf.reshape(-1, width)
+
+    dates = np.asarray(dates)
+    if dates.size == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+    if dates.dtype.kind == 'U':
+        # UCS4: the characters of ASCII text are every fourth byte
+        chars = dates.ravel().view(np.uint32).reshape(dates.size, -1)
+        if chars.size and chars.max() > 127:
+            raise ValueError('dates must be ASCII')
+        return chars.astype(np.uint8)
+    if dates.dtype.kind == 'S':
+        return dates.ravel().view(np.uint8).reshape(dates.size, -1)
+    raise TypeError('dates must be strings, or a buffer of lines of text')
+
+
+# padding that may follow a date: NUL (from numpy string arrays), space, CR and LF
+_PADDING = (0, ord(' '), ord('\r'), ord('\n'))
+
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _parse_isot(chars):
+    """ Calendar fields of the dates in the rows of chars (see _text_columns), and a
+    mask of the rows that are not valid dates. Works a column at a time; chars must
+    have at least 20 columns. """
+    def digit(col):
+        return chars[:, col].astype(np.int64) - ord('0')
+
+    def is_digit(col):
+        return (chars[:, col] >= ord('0')) & (chars[:, col] <= ord('9'))
+
+    def field(start, stop):
+        value = digit(start)
+        for col in range(start+1, stop):
+            value *= 10
+            value += digit(col)
+        return value
+
+    def is_padding(col):
+        pad = chars[:, col] == _PADDING[0]
+        for c in _PADDING[1:]:
+            pad |= chars[:, col] == c
+        return pad
+
+    ok = (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-'))
+    for col in (0, 1, 2, 3, 5, 6, 8, 9):
+        ok &= is_digit(col)
+    year, month, day = field(0, 4), field(5, 7), field(8, 10)
+    # end: the column after the last character of the date and time of each row
+    end = np.full(len(chars), 10)
+
+    # hh:mm, with an optional :ss and then .sss...
+    has_time = ((chars[:, 10] == ord('T')) | (chars[:, 10] == ord(' '))) & ~is_padding(11)
+    ok &= ~has_time | (is_digit(11) & is_digit(12) & (chars[:, 13] == ord(':'))
+                       & is_digit(14) & is_digit(15))
+    end[has_time] = 16
+    has_seconds = has_time & (chars[:, 16] == ord(':'))
+    ok &= ~has_seconds | (is_digit(17) & is_digit(18))
+    end[has_seconds] = 19
+    hour = np.where(has_time, field(11, 13), 0)
+    minute = np.where(has_time, field(14, 16), 0)
+    second = np.where(has_seconds, field(17, 19), 0).astype(np.float64)
+
+    # fractional seconds: the run of digits after a '.'
+    in_fraction = has_seconds & (chars[:, 19] == ord('.'))
+    end[in_fraction] = 20
+    scale = 1.0
+    for col in range(20, chars.shape[1]):
+        in_fraction &= is_digit(col)
+        if not in_fraction.any():
+            break
+        scale /= 10
+        second += np.where(in_fraction, digit(col) * scale, 0.0)
+        end[in_fraction] = col + 1
+
+    # all that may follow is a 'Z' for UT, then padding
+    for col in range(10, chars.shape[1]):
+        ok &= (col < end) | is_padding(col) | ((col == end) & (chars[:, col] == ord('Z')))
+
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    ok &= (month >= 1) & (month <= 12)
+    ok &= (day >= 1) & (day <= _DAYS_IN_MONTH[np.clip(month, 0, 12)] + (leap & (month == 2)))
+    # second 60 is a leap second
+    ok &= (hour <= 23) & (minute <= 59) & (second < 61)
+    return (year, month, day, hour, minute, second), ~ok
+
+
+def isot2jd(dates, two_part=False, chunksize=1048576):
+    """ Julian dates of ISO-8601 date strings, such as FITS DATE-OBS values.
+
+    Parses 'YYYY-MM-DD', 'YYYY-MM-DDThh:mm', 'YYYY-MM-DDThh:mm:ss' and
+    'YYYY-MM-DDThh:mm:ss.sss...' (with 'T' or a space before the time, and an optional
+    trailing 'Z'), UT. The fields are read from fixed character positions of all the
+    strings at once, with no Python loop over the dates. Anything else, including
+    out-of-range fields and time zone offsets, raises ValueError.
+
+    Parameters
+    ----------
+    dates : array_like or buffer
+        An array of str or bytes, or a buffer (bytes, or a uint8 numpy.memmap of a text
+        file) of newline-separated lines of equal length, one date per line
+    two_part : bool
+        As for gd2jd_array
+    chunksize : int
+        Number of dates parsed at a time, to bound the working memory
+
+    Returns
+    -------
+    jd : ndarray of float64, of the shape of dates (one per line for a buffer), or
+    (jd1, jd2) if two_part is set
+    """
+    if isinstance(dates, (bytes, bytearray, memoryview)) or \
+            (isinstance(dates, np.ndarray) and dates.dtype == np.uint8):
+        shape = None
+    else:
+        dates = np.asarray(dates)
+        shape = dates.shape
+    chars = _text_columns(dates)
+    if chars.shape[1] < 20:
+        # pad short strings, so that every row is checked the same way whatever the width
+        chars = np.hstack((chars, np.zeros((len(chars), 20 - chars.shape[1]), dtype=np.uint8)))
+
+    jd1 = np.empty(len(chars))
+    jd2 = np.empty(len(chars))
+    for start in range(0, len(chars), chunksize):
+        rows = slice(start, start+chunksize)
+        fields, bad = _parse_isot(chars[rows])
+        if bad.any():
+            row = start + np.flatnonzero(bad)[0]
+            raise ValueError('cannot parse date %d: %r' % (row, chars[row].tobytes().rstrip(b'\x00\r\n ')))
+        jd1[rows], jd2[rows] = gd2jd_array(*fields, two_part=True)
+
+    if shape is not None:
+        jd1, jd2 = jd1.reshape(shape), jd2.reshape(shape)
+    if two_part:
+        return jd1, jd2
+    return jd1 + jd2
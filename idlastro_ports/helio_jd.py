@@ -0,0 +1,128 @@
+"""
+Heliocentric Julian dates: light-travel-time corrections for arrays of (JD, RA, Dec).
+
+The geocentric position of the Sun is built from the sunpos machinery: its direction is
+the sunpos RA and Dec, precessed from the equinox of date to J2000, and its distance
+follows from the Earth's mean anomaly as used in sunpos. The correction for a target in
+the unit direction n is then
+
+    HJD = JD - (AU / c) * (sun . n)
+
+as in the IDL astro routine HELIO_JD. Positions are J2000. The Sun is taken as the
+reference point, so these are heliocentric, not barycentric, dates; the two differ by
+up to about 4 s, mainly through the pull of Jupiter on the Sun.
+
+The per-epoch terms (the Sun's position vector) are computed once per epoch and shared by
+every target, and helio_jd_grid() evaluates the whole N_time x N_target grid with one
+matrix product.
+"""
+import numpy as np
+
+from gcirc import _to_radians, _unit_vectors, d2r, as2r
+from sunpos import sunpos
+
+# light travel time for one astronomical unit, in days
+AU_DAYS = 499.004784 / 86400.0
+
+
+def _precession_to_j2000(jd):
+    """ (N, 3, 3) IAU 1976 precession matrices from the mean equinox of each Julian date
+    to J2000 """
+    t = (np.ravel(jd) - 2451545.0) / 36525.0
+    zeta = t * (2306.2181 + t * (0.30188 + t * 0.017998)) * as2r
+    z = t * (2306.2181 + t * (1.09468 + t * 0.018203)) * as2r
+    theta = t * (2004.3109 - t * (0.42665 + t * 0.041833)) * as2r
+    cz, sz = np.cos(zeta), np.sin(zeta)
+    cZ, sZ = np.cos(z), np.sin(z)
+    ct, st = np.cos(theta), np.sin(theta)
+    # rows of the J2000 -> date matrix, transposed
+    p = np.empty((len(t), 3, 3))
+    p[:, 0, 0] = cZ * ct * cz - sZ * sz
+    p[:, 1, 0] = -cZ * ct * sz - sZ * cz
+    p[:, 2, 0] = -cZ * st
+    p[:, 0, 1] = sZ * ct * cz + cZ * sz
+    p[:, 1, 1] = -sZ * ct * sz + cZ * cz
+    p[:, 2, 1] = -sZ * st
+    p[:, 0, 2] = st * cz
+    p[:, 1, 2] = -st * sz
+    p[:, 2, 2] = ct
+    return p
+
+
+def sun_vector(jd):
+    """ Geocentric position of the Sun, in AU, in J2000 equatorial coordinates.
+
+    Parameters
+    ----------
+    jd : array_like
+        Julian dates
+
+    Returns
+    -------
+    ndarray of shape jd.shape + (3,)
+    """
+    jd = np.asarray(jd, dtype=np.float64)
+    ra, dec = sunpos(jd, radian=True)
+    # distance from the Earth's mean anomaly, with the sunpos epoch and rate
+    t = (jd - 2415020.0) / 36525.0
+    me = (358.475844 + np.mod(35999.049750 * t, 360.0)) * d2r
+    distance = 1.000140 - 0.016708 * np.cos(me) - 0.000139 * np.cos(2 * me)
+    xyz = _unit_vectors(np.ravel(ra), np.ravel(dec)) * np.ravel(distance)[:, None]
+    xyz = np.einsum('nij,nj->ni', _precession_to_j2000(jd), xyz)
+    return xyz.reshape(jd.shape + (3,))
+
+
+def helio_jd(jd, ra, dc, units_in='degrees', time_diff=False):
+    """ Heliocentric Julian dates of observations made at (geocentric) Julian dates jd.
+
+    Parameters
+    ----------
+    jd : array_like
+        Julian dates of the observations
+    ra, dc : array_like
+        J2000 positions of the targets, in units_in; broadcast against jd
+    units_in : string
+        As for gcirc
+    time_diff : bool
+        If set, return the correction HJD - JD in seconds, instead of HJD
+
+    Returns
+    -------
+    ndarray of the broadcast shape of jd, ra and dc
+    """
+    jd = np.asarray(jd, dtype=np.float64)
+    rarad, dcrad = _to_radians(ra, dc, units_in)
+    # the Sun is computed once per element of jd, and broadcast across the targets
+    sun = sun_vector(jd)
+    cosdc = np.cos(dcrad)
+    corr = sun[..., 0] * (cosdc * np.cos(rarad))
+    corr += sun[..., 1] * (cosdc * np.sin(rarad))
+    corr += sun[..., 2] * np.sin(dcrad)
+    corr *= -AU_DAYS
+    return corr * 86400.0 if time_diff else jd + corr
+
+
+def helio_jd_grid(jd, ra, dc, units_in='degrees', time_diff=False):
+    """ Heliocentric Julian dates for every combination of epoch and target.
+
+    Parameters
+    ----------
+    jd : array_like, shape (ntime,)
+        Julian dates of the observations
+    ra, dc : array_like, shape (ntarget,)
+        J2000 positions of the targets, in units_in
+    units_in, time_diff :
+        As for helio_jd
+
+    Returns
+    -------
+    ndarray of shape (ntime, ntarget)
+    """
+    jd = np.ravel(np.asarray(jd, dtype=np.float64))
+    rarad, dcrad = _to_radians(np.ravel(ra), np.ravel(dc), units_in)
+    target = _unit_vectors(*np.broadcast_arrays(rarad, dcrad))
+    corr = np.dot(sun_vector(jd), target.T)
+    corr *= -AU_DAYS * 86400.0 if time_diff else -AU_DAYS
+    if not time_diff:
+        corr += jd[:, None]
+    return corr
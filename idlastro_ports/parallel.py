@@ -0,0 +1,209 @@
+"""
+Multi-threaded, chunked evaluation of the coordinate kernels gcirc, posang and sunpos.
+
+The inputs are broadcast together and split into chunks of a few tens of thousands of
+elements, cut along the first axis or, where one row is larger than that, along the
+later axes, small enough that the working arrays of a chunk stay in cache. Chunks are
+evaluated on a pool of threads (NumPy releases the GIL inside its ufunc loops, so the
+threads run in parallel), each of which reuses its own scratch buffers from chunk to
+chunk, and results are written straight into the output array, which may be provided by
+the caller. Memory use beyond the inputs and outputs is therefore about nthreads *
+chunksize * (a few) elements, whatever the size of the job.
+"""
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from gcirc import d2r, h2r, _angle_scale
+from sunpos import _sunpos_kernel, _NBUFFERS
+
+CHUNKSIZE = 32768
+
+_local = threading.local()
+
+
+def _scratch(shape, n):
+    """ n scratch arrays of the given shape, private to this thread and reused between chunks.
+    Each thread keeps one set of n flat buffers, grown to the largest chunk it has seen,
+    and views of their first elements are returned, so the cache does not grow with the
+    number of distinct chunk shapes. """
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = dict()
+    size = int(np.prod(shape))
+    if n not in buffers or len(buffers[n][0]) < size:
+        buffers[n] = [np.empty(size) for i in range(n)]
+    return [b[:size].reshape(shape) for b in buffers[n]]
+
+
+def _chunks(shape, chunksize):
+    """ Indices of chunks of at most chunksize elements each (or of one element, if
+    chunksize is smaller). The trailing axes that fit in a chunk are kept whole, the axis
+    before them is sliced, and any axes before that are indexed one element at a time, so
+    a few long rows are cut as finely as many short ones. """
+    axis = len(shape)
+    inner = 1
+    while axis > 0 and inner * shape[axis-1] <= chunksize:
+        axis -= 1
+        inner *= shape[axis]
+    if axis == 0:
+        return [Ellipsis]
+    step = max(1, chunksize // inner)
+    cuts = [slice(start, start+step) for start in range(0, shape[axis-1], step)]
+    return [index + (cut,) for index in np.ndindex(*shape[:axis-1]) for cut in cuts]
+
+
+def _run(kernel, inputs, outputs, nthreads, chunksize):
+    """ Call kernel(inputs[chunk], outputs[chunk]) for every chunk, on a pool of threads """
+    chunks = _chunks(outputs[0].shape, chunksize)
+    def work(chunk):
+        kernel([a[chunk] for a in inputs], [a[chunk] for a in outputs])
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads <= 1 or len(chunks) == 1:
+        try:
+            for chunk in chunks:
+                work(chunk)
+        finally:
+            # the calling thread outlives the job: do not keep its scratch between calls
+            _local.__dict__.pop('buffers', None)
+        return
+    pool = ThreadPool(min(nthreads, len(chunks)))
+    try:
+        pool.map(work, chunks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _unit_factors(units_in):
+    """ Radians per unit of RA and of Dec for units_in """
+    if units_in == 'radians':
+        return 1.0, 1.0
+    elif units_in == 'hours':
+        return h2r, d2r
+    elif units_in == 'degrees':
+        return d2r, d2r
+    raise ValueError("units_in must be one of {radians, hours, degrees} to define the units for RA.")
+
+
+def _broadcast(args, out, nout=1):
+    """ Broadcast the inputs against each other, and check or allocate the outputs """
+    inputs = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in args])
+    shape = inputs[0].shape
+    if out is None:
+        out = tuple(np.empty(shape) for i in range(nout))
+    elif nout == 1:
+        out = (out,)
+    for a in out:
+        if a.shape != shape:
+            raise ValueError("out must have the broadcast shape of the inputs, %s" % (shape,))
+    return inputs, out
+
+
+def parallel_gcirc(ra1, dc1, ra2, dc2, units_in='degrees', units_out='arcsec', out=None,
+        nthreads=None, chunksize=CHUNKSIZE):
+    """ gcirc, evaluated in cache-sized chunks on a pool of threads.
+
+    Parameters are as for gcirc, plus:
+
+    out : ndarray
+        Array to write the distances into, of the broadcast shape of the inputs
+    nthreads : int
+        Number of threads; defaults to the number of CPUs
+    chunksize : int
+        Approximate number of elements per chunk
+
+    Returns out.
+    """
+    f_ra, f_dc = _unit_factors(units_in)
+    scale_out = 2.0 / _angle_scale(units_out)
+    (ra1, dc1, ra2, dc2), (out,) = _broadcast((ra1, dc1, ra2, dc2), out)
+
+    def kernel(inputs, outputs):
+        ra1, dc1, ra2, dc2 = inputs
+        dis, = outputs
+        a, b, c = _scratch(dis.shape, 3)
+        # haversine formula, as in gcirc
+        np.subtract(dc2, dc1, out=a)
+        a *= f_dc / 2
+        np.sin(a, out=a)
+        a *= a
+        np.subtract(ra2, ra1, out=b)
+        b *= f_ra / 2
+        np.sin(b, out=b)
+        b *= b
+        for dc in (dc1, dc2):
+            np.multiply(dc, f_dc, out=c)
+            np.cos(c, out=c)
+            b *= c
+        a += b
+        np.sqrt(a, out=a)
+        np.minimum(a, 1, out=a)
+        np.arcsin(a, out=a)
+        np.multiply(a, scale_out, out=dis)
+
+    _run(kernel, (ra1, dc1, ra2, dc2), (out,), nthreads, chunksize)
+    return out
+
+
+def parallel_posang(ra1, dc1, ra2, dc2, units_in='radians', units_out='radians', out=None,
+        nthreads=None, chunksize=CHUNKSIZE):
+    """ posang, evaluated in cache-sized chunks on a pool of threads.
+
+    Parameters are as for posang, plus out, nthreads and chunksize as for parallel_gcirc.
+    Returns out.
+    """
+    f_ra, f_dc = _unit_factors(units_in)
+    if units_out == 'degrees':
+        scale_out = 1 / d2r
+    elif units_out == 'radians':
+        scale_out = 1.0
+    else:
+        raise ValueError('units_out must be one of {radians, degrees}')
+    (ra1, dc1, ra2, dc2), (out,) = _broadcast((ra1, dc1, ra2, dc2), out)
+
+    def kernel(inputs, outputs):
+        ra1, dc1, ra2, dc2 = inputs
+        angle, = outputs
+        sinra, cosra, sin1, cos1, tan2 = _scratch(angle.shape, 5)
+        # four-parts formula, as in posang
+        np.subtract(ra2, ra1, out=sinra)
+        sinra *= f_ra
+        np.cos(sinra, out=cosra)
+        np.sin(sinra, out=sinra)
+        np.multiply(dc1, f_dc, out=sin1)
+        np.cos(sin1, out=cos1)
+        np.sin(sin1, out=sin1)
+        np.multiply(dc2, f_dc, out=tan2)
+        np.tan(tan2, out=tan2)
+        tan2 *= cos1
+        cosra *= sin1
+        tan2 -= cosra
+        np.arctan2(sinra, tan2, out=angle)
+        if scale_out != 1.0: angle *= scale_out
+
+    _run(kernel, (ra1, dc1, ra2, dc2), (out,), nthreads, chunksize)
+    return out
+
+
+def parallel_sunpos(jd, return_all=False, radian=False, out=None, nthreads=None, chunksize=CHUNKSIZE):
+    """ sunpos, evaluated in cache-sized chunks on a pool of threads.
+
+    Parameters are as for sunpos, plus nthreads and chunksize as for parallel_gcirc, and:
+
+    out : tuple of ndarrays
+        Arrays to write the results into: (ra, dec), or (ra, dec, obliquity, longmed)
+        if return_all is set
+
+    Returns the tuple of output arrays.
+    """
+    (jd,), out = _broadcast((jd,), out, nout=4 if return_all else 2)
+
+    def kernel(inputs, outputs):
+        _sunpos_kernel(inputs[0], outputs, radian, _scratch(inputs[0].shape, _NBUFFERS))
+
+    _run(kernel, (jd,), out, nthreads, chunksize)
+    return out
@@ -1,7 +1,19 @@
+from __future__ import print_function
 import numpy as np
 
+from gcirc import _to_radians, _angle_scale, _sky_vector_args, d2r, h2r
 
-def posang(ra1, dc1, ra2, dc2, units_in='radians', units_out='radians'):
+
+def _vector_posang(p1, p2):
+    """ Position angle in radians of SkyVector p2 relative to p1, from the components
+    of p2 along the directions east and north at p1 """
+    x, y, z = p2.xyz[..., 0], p2.xyz[..., 1], p2.xyz[..., 2]
+    east = y * p1.cosra - x * p1.sinra
+    north = z * p1.cosdc - p1.sindc * (x * p1.cosra + y * p1.sinra)
+    return np.arctan2(east, north)
+
+
+def posang(ra1, dc1, ra2=None, dc2=None, units_in='radians', units_out='radians'):
     """
     Ported from IDL posang.pro by Marshall Perrin
 
@@ -65,40 +77,28 @@ def posang(ra1, dc1, ra2, dc2, units_in='radians', units_out='radians'):
            Modified from GCIRC, R. S. Hill, RSTX, 1 Apr. 1998
            Use V6.0 notation W.L. Mar 2011
 
+     SKYVECTOR INPUTS:
+           Either position (RA1, DC1 or RA2, DC2) may be given as a single
+           SkyVector from gcirc.py instead, e.g. posang(sv1, sv2). The angle is
+           then computed from the unit vectors and the cached sin/cos of RA1, DC1.
     """
 
-    scalar_ = not (hasattr(ra1, '__len__') or hasattr(ra2, '__len__'))
-    if scalar_:
-        if (ra1 == ra2) and  (dc1 == dc2):
-            angle = 0.0e0
-            print 'Positions are equal:  ', ra1, dc1
-            return angle
-
-    d2r = np.pi / 180.0
-    h2r = np.pi / 12.0
-
-    
-    if units_in=='radians':
-        rarad1 = ra1
-        rarad2 = ra2
-        dcrad1 = dc1
-        dcrad2 = dc2
-    elif units_in=='hours':
-        rarad1 = ra1 * h2r
-        rarad2 = ra2 * h2r
-        dcrad1 = dc1 * d2r
-        dcrad2 = dc2 * d2r
-    elif units_in=='degrees':
-        rarad1 = ra1 * d2r
-        rarad2 = ra2 * d2r
-        dcrad1 = dc1 * d2r
-        dcrad2 = dc2 * d2r
+    positions = _sky_vector_args((ra1, dc1, ra2, dc2), units_in)
+    if positions is not None:
+        angle = _vector_posang(*positions)
     else:
-        raise ValueError("units_in must be one of {radians, hours, degrees} to define the units for RA.")
-    
+        scalar_ = not (hasattr(ra1, '__len__') or hasattr(ra2, '__len__'))
+        if scalar_:
+            if (ra1 == ra2) and  (dc1 == dc2):
+                angle = 0.0e0
+                print('Positions are equal:  ', ra1, dc1)
+                return angle
 
-    radif = rarad2 - rarad1
-    angle = np.arctan2(np.sin(radif), np.cos(dcrad1) * np.tan(dcrad2) - np.sin(dcrad1) * np.cos(radif))
+        rarad1, dcrad1 = _to_radians(ra1, dc1, units_in)
+        rarad2, dcrad2 = _to_radians(ra2, dc2, units_in)
+
+        radif = rarad2 - rarad1
+        angle = np.arctan2(np.sin(radif), np.cos(dcrad1) * np.tan(dcrad2) - np.sin(dcrad1) * np.cos(radif))
 
 
     if units_out =='degrees':
@@ -111,3 +111,129 @@ def posang(ra1, dc1, ra2, dc2, units_in='radians', units_out='radians'):
     return angle
 
 
+
+
+def sep_posang(ra1, dc1, ra2, dc2, units_in='degrees', units_out='arcsec', offsets=False):
+    """ Separation and position angle of source 2 relative to source 1, in one pass.
+
+    Equivalent to calling gcirc and posang on the same positions, but the units are
+    converted and the trig functions of both positions evaluated only once, so it costs
+    about the same as gcirc alone. The components of source 2 along the east and north
+    directions at source 1 give the position angle directly; together with the cosine of
+    the separation they give the separation itself, as an atan2 which is accurate at
+    all angles, and optionally the tangent plane offsets.
+
+    Parameters
+    ----------
+    ra1, dc1, ra2, dc2 : array_like
+        Positions, broadcast against each other as for gcirc
+    units_in : string
+        As for gcirc
+    units_out : string
+        Units of the separation and offsets, as for gcirc. The position angle is in
+        radians if this is 'radians', otherwise in degrees.
+    offsets : bool
+        Also return the offsets of source 2 in the plane tangent to the sky at source 1
+        (gnomonic standard coordinates), which are dRA cos(Dec) and dDec for small
+        separations. They are only meaningful for separations under 90 degrees.
+
+    Returns
+    -------
+    sep, pa : ndarray
+        Separation and position angle (north through east)
+    xi, eta : ndarray
+        Offsets east and north, in units_out (only if offsets is set)
+    """
+    scale = _angle_scale(units_out)
+    rarad1, dcrad1 = _to_radians(ra1, dc1, units_in)
+    rarad2, dcrad2 = _to_radians(ra2, dc2, units_in)
+
+    dra = rarad2 - rarad1
+    sin_dra, cos_dra = np.sin(dra), np.cos(dra)
+    sin1, cos1 = np.sin(dcrad1), np.cos(dcrad1)
+    sin2, cos2 = np.sin(dcrad2), np.cos(dcrad2)
+
+    east = cos2 * sin_dra
+    cos2_cos_dra = cos2 * cos_dra
+    north = cos1 * sin2 - sin1 * cos2_cos_dra
+    cos_sep = sin1 * sin2 + cos1 * cos2_cos_dra
+
+    sep = np.arctan2(np.sqrt(east*east + north*north), cos_sep) / scale
+    pa = np.arctan2(east, north)
+    if units_out != 'radians':
+        pa /= d2r
+    if not offsets:
+        return sep, pa
+    return sep, pa, east / cos_sep / scale, north / cos_sep / scale
+
+
+def offset_radec(ra1, dc1, angle, dis, units_in='radians', units_angle='radians', units_dis='arcsec',
+        outer=False, out=None):
+    """ Positions at a given position angle and separation from a center.
+
+    The inverse of posang and gcirc: the destination reached by travelling dis along
+    the great circle leaving (ra1, dc1) at position angle angle (north through east).
+    Computed in vector form, which is exact at all separations and near the poles.
+
+    Parameters
+    ----------
+    ra1, dc1 : array_like
+        Center(s), in units_in
+    angle : array_like
+        Position angle(s), in units_angle ('radians' or 'degrees', as for posang's units_out)
+    dis : array_like
+        Separation(s), in units_dis ('radians', 'degrees' or 'arcsec', as for gcirc's units_out)
+    units_in : string
+        Units of the centers and of the returned positions, as for posang
+    outer : bool
+        If set, return every combination of the flattened centers, position angles and
+        separations, as arrays of shape (ncenters, nangles, ndis). Otherwise the inputs
+        are simply broadcast against each other.
+    out : tuple of two arrays
+        Arrays to write the RA and Dec into, of the output shape
+
+    Returns
+    -------
+    ra2, dc2 : ndarray
+        Destinations, in units_in, with RA in the range 0 to 24 hours, 360 degrees or 2 pi.
+    """
+    rarad1, dcrad1 = _to_radians(ra1, dc1, units_in)
+    if units_angle == 'degrees':
+        theta = np.asarray(angle, dtype=np.float64) * d2r
+    elif units_angle == 'radians':
+        theta = np.asarray(angle, dtype=np.float64)
+    else:
+        raise ValueError('units_angle must be one of {radians, degrees}')
+    s = np.asarray(dis, dtype=np.float64) * _angle_scale(units_dis)
+
+    if outer:
+        rarad1, dcrad1 = np.broadcast_arrays(rarad1, dcrad1)
+        rarad1 = rarad1.reshape(-1, 1, 1)
+        dcrad1 = dcrad1.reshape(-1, 1, 1)
+        theta = theta.reshape(1, -1, 1)
+        s = s.reshape(1, 1, -1)
+
+    sin1, cos1 = np.sin(dcrad1), np.cos(dcrad1)
+    sins, coss = np.sin(s), np.cos(s)
+    sins_cost = sins * np.cos(theta)
+    # components of the destination toward the center's meridian, east, and north pole
+    radial = coss * cos1 - sins_cost * sin1
+    east = sins * np.sin(theta)
+    z = coss * sin1 + sins_cost * cos1
+
+    shape = np.broadcast(rarad1, radial).shape
+    if out is None:
+        out = (np.empty(shape), np.empty(shape))
+    ra2, dc2 = out
+    np.arctan2(east, radial, out=ra2)
+    ra2 += rarad1
+    np.mod(ra2, 2*np.pi, out=ra2)
+    np.arctan2(z, np.sqrt(radial*radial + east*east), out=dc2)
+
+    if units_in == 'hours':
+        ra2 /= h2r
+        dc2 /= d2r
+    elif units_in == 'degrees':
+        ra2 /= d2r
+        dc2 /= d2r
+    return ra2, dc2
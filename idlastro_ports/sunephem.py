@@ -0,0 +1,246 @@
+"""
+Chebyshev-compressed solar ephemeris, for evaluating sunpos at very many epochs.
+
+SunEphemeris.fit() samples sunpos over a span of Julian dates and fits each of RA, Dec,
+obliquity and mean longitude with a Chebyshev series on consecutive segments of equal
+length. Evaluating the ephemeris then costs one Clenshaw recurrence per quantity instead
+of sunpos' twenty-odd trigonometric terms. For RA and Dec at 1e6 epochs over ten years
+(one thread, NumPy 2.4) it measured six to eight times faster than sunpos at
+time-ordered epochs, where whole runs of epochs share a segment's coefficients, and three
+to five times faster at randomly scattered epochs, where each epoch's coefficients are
+gathered from the table. The ratios vary from machine to machine, the scattered case
+most, as it is bound by memory access.
+
+Accuracy: sunpos is a sum of smooth periodic terms, the shortest being the lunar term
+with a period of 29.5 days, so the Chebyshev coefficients decay geometrically and the
+truncation error is tiny. The fit error is measured against sunpos at fit time, on a
+grid sixty-four times denser than the fit nodes that includes the segment ends, and kept
+as max_error (degrees, one per quantity). This is an estimate, not a bound: what remains
+is mostly sunpos' own rounding noise, whose largest value over all epochs is somewhat
+higher than over any grid. Twice max_error is a safe bound. With the defaults (16 day
+segments, degree 11) max_error is a few times 1e-10 degrees, and the error is always
+below 1e-9 degrees: far inside sunpos' error of a few arcsec relative to the true Sun.
+
+The coefficients are saved to, and loaded from, a plain .npy file, which can be
+memory-mapped. Its array has shape (nseg+1, 4, ncoef): row 0 is a header holding the
+start JD and segment length in [0, 0:2, 0] and max_error in [0, :, 1], and row s+1 holds
+the coefficients of segment s, for RA, Dec, obliquity and longmed in degrees (RA and
+longmed unwrapped within the segment).
+"""
+import numpy as np
+
+from sunpos import sunpos
+
+_RA, _DEC, _OBLT, _LONGMED = range(4)
+
+
+def _chebyshev_nodes(ncoef):
+    """ The ncoef Chebyshev nodes on [-1, 1] """
+    return np.cos(np.pi * (np.arange(ncoef) + 0.5) / ncoef)
+
+
+def _unwrap(values, axis=-1):
+    """ Angles in degrees made continuous along axis, relative to the first value """
+    ref = np.take(values, [0], axis=axis)
+    return ref + (values - ref + 180.) % 360. - 180.
+
+
+def _clenshaw(coeffs, x, out, scratch=None):
+    """ Sum over k of coeffs[k] T_k(x), written into out. Each coeffs[k] is either a
+    scalar, or an array of the shape of x holding a separate coefficient for each x.
+    scratch, if given, is a (4,) + x.shape array to hold the working arrays. """
+    if scratch is None:
+        scratch = np.empty((4,) + out.shape)
+    x2, b1, b2, tmp = scratch
+    np.multiply(x, 2, out=x2)
+    b1.fill(0.)
+    b2.fill(0.)
+    for k in range(len(coeffs)-1, 0, -1):
+        # b1, b2 <- c_k + 2x b1 - b2, b1, with b2 reused as the new b1
+        np.multiply(x2, b1, out=tmp)
+        np.subtract(tmp, b2, out=b2)
+        b2 += coeffs[k]
+        b1, b2 = b2, b1
+    np.multiply(x, b1, out=out)
+    out -= b2
+    out += coeffs[0]
+    return out
+
+
+class SunEphemeris(object):
+    """ Piecewise Chebyshev fit of sunpos over a range of Julian dates.
+
+    Create one with SunEphemeris.fit() or SunEphemeris.load(), and evaluate it with
+    sunpos(), which takes the same arguments as sunpos.sunpos plus out=.
+
+    Attributes
+    ----------
+    jd_start, jd_end : float
+        Range of Julian dates covered
+    span : float
+        Length of each segment, in days
+    coeffs : ndarray, shape (nseg, 4, ncoef)
+        Chebyshev coefficients of RA, Dec, obliquity and longmed for each segment
+    max_error : ndarray, shape (4,)
+        Largest error in each quantity found when the fit was made, in degrees; an
+        estimate of the largest error over all epochs, which may be up to twice this
+    """
+
+    def __init__(self, coeffs, jd_start, span, max_error=None):
+        self.coeffs = coeffs
+        self.jd_start = float(jd_start)
+        self.span = float(span)
+        self.jd_end = self.jd_start + self.span * len(coeffs)
+        self.max_error = max_error
+        # series length per quantity, dropping trailing terms too small to matter (the
+        # obliquity, for one, needs only a few)
+        significant = np.abs(coeffs).max(axis=0) > 1e-13
+        self._nterms = [np.flatnonzero(sig)[-1] + 1 if sig.any() else 1 for sig in significant]
+        # coefficients by quantity and term, for gathering at scattered epochs; built
+        # when first needed
+        self._columns = None
+
+    @classmethod
+    def fit(cls, jd_start, jd_end, span=16.0, degree=11):
+        """ Fit sunpos between Julian dates jd_start and jd_end.
+
+        Parameters
+        ----------
+        jd_start, jd_end : float
+            Range to cover; it is extended up to a whole number of segments
+        span : float
+            Segment length in days
+        degree : int
+            Degree of the Chebyshev series on each segment (at least 1)
+
+        Returns
+        -------
+        SunEphemeris, with max_error estimated on a dense grid of epochs.
+        """
+        ncoef = int(degree) + 1
+        if ncoef < 2:
+            raise ValueError('degree must be at least 1')
+        nseg = max(1, int(np.ceil((jd_end - jd_start) / span)))
+        nodes = _chebyshev_nodes(ncoef)
+        starts = jd_start + span * np.arange(nseg)
+        jd = starts[:, None] + span * (nodes + 1) / 2
+
+        values = np.array(sunpos(jd, return_all=True))          # (4, nseg, ncoef)
+        values[_RA] = _unwrap(values[_RA])
+        values[_LONGMED] = _unwrap(values[_LONGMED])
+
+        # discrete Chebyshev transform at the nodes: exact interpolation of the samples
+        k = np.arange(ncoef)
+        basis = np.cos(np.pi * k[:, None] * (np.arange(ncoef) + 0.5) / ncoef) * (2. / ncoef)
+        basis[0] /= 2
+        coeffs = np.einsum('qsj,kj->sqk', values, basis)
+
+        ephem = cls(np.ascontiguousarray(coeffs), jd_start, span)
+        ephem.max_error = ephem._measure_error(64 * ncoef)
+        return ephem
+
+    def _measure_error(self, npoints):
+        """ Largest difference from sunpos of each quantity, in degrees, at npoints + 1
+        evenly spaced epochs per segment, from its start to its end """
+        offsets = np.arange(npoints + 1) / float(npoints)
+        max_error = np.zeros(4)
+        for start in range(0, len(self.coeffs), 128):
+            segs = np.arange(start, min(start+128, len(self.coeffs)))
+            jd = (self.jd_start + self.span * (segs[:, None] + offsets)).ravel()
+            exact = sunpos(jd, return_all=True)
+            approx = self.sunpos(jd, return_all=True)
+            for q in range(4):
+                diff = approx[q] - exact[q]
+                if q in (_RA, _LONGMED):
+                    diff = (diff + 180.) % 360. - 180.
+                max_error[q] = max(max_error[q], np.abs(diff).max())
+        return max_error
+
+    def save(self, filename):
+        """ Save the coefficients to a .npy file """
+        table = np.zeros((len(self.coeffs)+1,) + self.coeffs.shape[1:])
+        table[0, 0:2, 0] = self.jd_start, self.span
+        if self.max_error is not None:
+            table[0, :, 1] = self.max_error
+        table[1:] = self.coeffs
+        np.save(filename, table)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """ Load an ephemeris saved by save(), memory-mapping the coefficients if mmap is set """
+        table = np.load(filename, mmap_mode='r' if mmap else None)
+        jd_start, span = table[0, 0:2, 0]
+        return cls(table[1:], jd_start, span, max_error=np.array(table[0, :, 1]))
+
+    def sunpos(self, jd, return_all=False, radian=False, out=None, chunksize=65536):
+        """ RA and Dec of the Sun from the fitted ephemeris; see sunpos.sunpos.
+
+        Parameters
+        ----------
+        jd : array_like
+            Julian dates, all between jd_start and jd_end
+        return_all, radian :
+            As for sunpos.sunpos
+        out : tuple of ndarrays
+            Arrays to write the results into, of the shape of jd: (ra, dec), or
+            (ra, dec, obliquity, longmed) if return_all is set
+        chunksize : int
+            Number of epochs evaluated at a time
+
+        Returns
+        -------
+        (ra, dec) or (ra, dec, obliquity, longmed), in degrees or radians
+        """
+        jd = np.asarray(jd, dtype=np.float64)
+        nout = 4 if return_all else 2
+        if out is None:
+            out = tuple(np.empty(jd.shape) for q in range(nout))
+        if len(out) != nout:
+            raise ValueError('out must hold %d arrays' % nout)
+        if jd.size and (jd.min() < self.jd_start or jd.max() > self.jd_end):
+            raise ValueError('jd outside the range of the ephemeris, %.1f to %.1f' % (self.jd_start, self.jd_end))
+
+        flat_jd = jd.reshape(-1)
+        if not all(o.shape == jd.shape and o.flags.c_contiguous for o in out):
+            raise ValueError('out arrays must be contiguous, of the shape of jd')
+        flat_out = [o.reshape(-1) for o in out]
+        scratch = np.empty((4, min(chunksize, len(flat_jd))))
+        for start in range(0, len(flat_jd), chunksize):
+            chunk = slice(start, start+chunksize)
+            self._evaluate(flat_jd[chunk], [o[chunk] for o in flat_out], scratch)
+        for q, o in enumerate(out):
+            if q in (_RA, _LONGMED):
+                # wrap into [0, 360) degrees; cheaper than np.mod
+                o -= 360. * np.floor(o / 360.)
+            if radian:
+                o *= np.pi / 180.
+        return out
+
+    def _evaluate(self, jd, out, scratch):
+        """ The first len(out) fitted quantities at jd (1-d), written into out, using
+        scratch (at least (4, len(jd))) for the working arrays """
+        pos = (jd - self.jd_start) / self.span
+        seg = np.minimum(pos.astype(np.intp), len(self.coeffs) - 1)
+        x = 2 * (pos - seg) - 1
+
+        breaks = np.flatnonzero(seg[1:] != seg[:-1]) + 1
+        if len(breaks) < len(jd) // 64:
+            # runs of epochs in the same segment: scalar coefficients per run
+            bounds = np.concatenate(([0], breaks, [len(jd)]))
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                coeffs = self.coeffs[seg[lo]]
+                for q, o in enumerate(out):
+                    _clenshaw(coeffs[q, :self._nterms[q]], x[lo:hi], o[lo:hi],
+                              scratch[:, :hi-lo])
+        else:
+            # scattered epochs: gather each epoch's coefficients, one term at a time, from
+            # a copy of the table laid out by quantity and term
+            if self._columns is None:
+                self._columns = [np.ascontiguousarray(self.coeffs[:, q, :n].T)
+                                 for q, n in enumerate(self._nterms)]
+            gathered = np.empty((max(self._nterms[:len(out)]), len(jd)))
+            for q, o in enumerate(out):
+                columns = self._columns[q]
+                for k in range(len(columns)):
+                    np.take(columns[k], seg, out=gathered[k])
+                _clenshaw(gathered[:len(columns)], x, o, scratch[:, :len(jd)])
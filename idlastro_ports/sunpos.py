@@ -1,8 +1,22 @@
 import numpy as np
 
+dtor = np.pi / 180.0       #(degrees to radian, double precision)
 
+CHUNKSIZE = 65536
 
-def sunpos(jd=None, return_all=False, radian=False):
+# Periodic perturbations of the Sun's longitude, in arcsec, from sunpos.pro:
+# amplitude * cos((phase + mv_coeff * MV + me_coeff * ME) * dtor), and so on for the
+# mean anomalies of Venus (MV), Mars (MM) and Jupiter (MJ)
+_VENUS_TERMS = ((4.8, 299.1017, 1.0, -1.0), (5.5, 148.3133, 2.0, -2.0), (2.5, 315.9433, 2.0, -3.0),
+                (1.6, 345.2533, 3.0, -4.0), (1.0, 318.15, 3.0, -5.0))
+_MARS_TERMS = ((2.0, 343.8883, -2.0, 2.0), (1.8, 200.4017, -2.0, 1.0))
+_JUPITER_TERMS = ((7.2, 179.5317, -1.0, 1.0), (2.6, 263.2167, -1.0, 0.0), (2.7, 87.1450, -2.0, 2.0),
+                  (1.6, 109.4933, -2.0, 1.0))
+
+_NBUFFERS = 6
+
+
+def sunpos(jd=None, return_all=False, radian=False, out=None, dtype=np.float64, chunksize=CHUNKSIZE):
     """
     sunpos: Compute the RA and Dec of the sun on a given date. 
     Converted from IDL astro sunpos.pro to Python by Marshall Perrin. 
@@ -33,6 +47,15 @@ def sunpos(jd=None, return_all=False, radian=False):
      OPTIONAL INPUT KEYWORD:
            /RADIAN - If this keyword is set and non-zero, then all output variables
                    are given in Radians rather than Degrees
+
+     PYTHON KEYWORDS:
+           out   - tuple of arrays of the shape of jd to write the outputs into:
+                   (ra, dec), or (ra, dec, obliquity, longmed) if return_all is set
+           dtype - dtype of the output arrays when out is not given; np.float32
+                   halves their size. The arithmetic is always double precision,
+                   which the Julian dates need.
+           chunksize - number of epochs evaluated at a time. Working memory is a
+                   few arrays of this length, however long jd is.
     
      NOTES:
            Patrick Wallace (Rutherford Appleton Laboratory, UK) has tested the
@@ -79,105 +102,140 @@ def sunpos(jd=None, return_all=False, radian=False):
 
     if jd is None:
         import datetime
-        dd = datetime.datetime(2011,1,1,0)
-        now = dd.utcnow()
+        from gd2jd import gd2jd
+        now = datetime.datetime.utcnow()
         jd = gd2jd(now.year, now.month, now.day, now.hour+(now.minute+now.second/60.)/60.)
-    jd = np.asarray(jd)
+    jd = np.asarray(jd, dtype=np.float64)
+
+    nout = 4 if return_all else 2
+    scalar = out is None and jd.ndim == 0
+    if out is None:
+        out = tuple(np.empty(jd.shape, dtype=dtype) for i in range(nout))
+    if len(out) != nout or any(o.shape != jd.shape or not o.flags.c_contiguous for o in out):
+        raise ValueError('out must hold %d contiguous arrays of the shape of jd' % nout)
+
+    flat_jd = jd.reshape(-1)
+    flat_out = [o.reshape(-1) for o in out]
+    n = min(chunksize, len(flat_jd))
+    buffers = [np.empty(n) for i in range(_NBUFFERS)]
+    for start in range(0, len(flat_jd), chunksize):
+        chunk = slice(start, start+chunksize)
+        size = len(flat_jd[chunk])
+        _sunpos_kernel(flat_jd[chunk], [f[chunk] for f in flat_out], radian,
+                       [b[:size] for b in buffers])
+
+    if scalar:
+        return tuple(o[()] for o in out)
+    return tuple(out)
+
+
+def _mean_anomaly(t, rate, epoch, out):
+    """ epoch + mod(rate * t, 360) degrees, written into out """
+    np.multiply(t, rate, out=out)
+    np.mod(out, 360.0, out=out)
+    out += epoch
+    return out
+
+
+def _add_terms(l, terms, m, me, arg, tmp):
+    """ l += sum of amplitude * cos((phase + a * m + b * me) * dtor) over terms, in place """
+    for amplitude, phase, a, b in terms:
+        np.multiply(m, a * dtor, out=arg)
+        if b:
+            np.multiply(me, b * dtor, out=tmp)
+            arg += tmp
+        arg += phase * dtor
+        np.cos(arg, out=arg)
+        arg *= amplitude
+        l += arg
+
+
+def _sunpos_kernel(jd, out, radian, buffers):
+    """ sunpos for the epochs jd, written into out = [ra, dec(, oblt, longmed)], of the
+    shape of jd. Every intermediate is held in buffers, _NBUFFERS float64 arrays also of
+    the shape of jd, so nothing of that size is allocated. """
+    t, l, me, m, arg, tmp = buffers
 
-    
-    dtor = np.pi / 180.0       #(degrees to radian, double precision)
-    
     #  form time in Julian centuries from 1900.0
-    
-    t = (jd - 2415020.0e0) / 36525.0e0
-    
-    #  form sun's mean longitude
-    
-    l = (279.696678 + np.mod((36000.768925 * t) , 360.0)) * 3600.0
-    
+    np.subtract(jd, 2415020.0e0, out=t)
+    t /= 36525.0e0
+
+    #  form sun's mean longitude, in arcsec
+    _mean_anomaly(t, 36000.768925, 279.696678, l)
+    l *= 3600.0
+
     #  allow for ellipticity of the orbit (equation of centre)
     #  using the Earth's mean anomaly ME
-    
-    me = 358.475844 + ((35999.049750 * t) % 360.0e0)
-    ellcor = (6910.1 - 17.2 * t) * np.sin(me * dtor) + 72.3 * np.sin(2.0 * me * dtor)
-    l = l + ellcor
-    
-    # allow for the Venus perturbations using the mean anomaly of Venus MV
-    
-    mv = 212.603219 + np.mod((58517.803875 * t) , 360.0)
-    vencorr = 4.8 * np.cos((299.1017 + mv - me) * dtor) + 5.5 * np.cos((148.3133 + 2.0 * mv - 2.0 * me) * dtor) + 2.5 * np.cos((315.9433 + 2.0 * mv - 3.0 * me) * dtor) + 1.6 * np.cos((345.2533 + 3.0 * mv - 4.0 * me) * dtor) + 1.0 * np.cos((318.15 + 3.0 * mv - 5.0 * me) * dtor)
-    l = l + vencorr
-    
-    #  Allow for the Mars perturbations using the mean anomaly of Mars MM
-    
-    mm = 319.529425 + ((19139.858500 * t) % 360.0e0)
-    marscorr = 2.0 * np.cos((343.8883 - 2.0 * mm + 2.0 * me) * dtor) + 1.8 * np.cos((200.4017 - 2.0 * mm + me) * dtor)
-    l = l + marscorr
-    
-    # Allow for the Jupiter perturbations using the mean anomaly of
-    # Jupiter MJ
-    
-    mj = 225.328328 + ((3034.6920239 * t) % 360.0e0)
-    jupcorr = 7.2 * np.cos((179.5317 - mj + me) * dtor) + 2.6 * np.cos((263.2167 - mj) * dtor) + 2.7 * np.cos((87.1450 - 2.0 * mj + 2.0 * me) * dtor) + 1.6 * np.cos((109.4933 - 2.0 * mj + me) * dtor)
-    l = l + jupcorr
-    
+    _mean_anomaly(t, 35999.049750, 358.475844, me)
+    np.multiply(me, dtor, out=arg)
+    np.sin(arg, out=arg)
+    np.multiply(t, -17.2, out=tmp)
+    tmp += 6910.1
+    arg *= tmp
+    l += arg
+    np.multiply(me, 2.0 * dtor, out=arg)
+    np.sin(arg, out=arg)
+    arg *= 72.3
+    l += arg
+
+    # allow for the Venus, Mars and Jupiter perturbations using their mean anomalies
+    _add_terms(l, _VENUS_TERMS, _mean_anomaly(t, 58517.803875, 212.603219, m), me, arg, tmp)
+    _add_terms(l, _MARS_TERMS, _mean_anomaly(t, 19139.858500, 319.529425, m), me, arg, tmp)
+    _add_terms(l, _JUPITER_TERMS, _mean_anomaly(t, 3034.6920239, 225.328328, m), me, arg, tmp)
+
     # Allow for the Moons perturbations using the mean elongation of
     # the Moon from the Sun D
-    
-    d = 350.7376814 + ((445267.11422 * t) % 360.0e0)
-    mooncorr = 6.5 * np.sin(d * dtor)
-    l = l + mooncorr
-    
-    # Allow for long period terms
-    
-    longterm = +6.4 * np.sin((231.19 + 20.20 * t) * dtor)
-    l = l + longterm
-    l = (l + 2592000.0e0) % 1296000.0e0
-    longmed = l / 3600.0e0
-    
-    # Allow for Aberration
-    
-    l = l - 20.5e0
-    
-    # Allow for Nutation using the longitude of the Moons mean node OMEGA
-    
-    omega = 259.183275 - np.mod((1934.142008 * t) , 360.0)
-    l = l - 17.2 * np.sin(omega * dtor)
-    
-    # Form the True Obliquity
-    
-    oblt = 23.452294 - 0.0130125 * t + (9.2 * np.cos(omega * dtor)) / 3600.0e0
-    
-    # Form Right Ascension and Declination
-    
-    l = l / 3600.0e0
-    #print l, oblt
-    ra = np.arctan2(np.sin(l * dtor) * np.cos(oblt * dtor), np.cos(l * dtor))
-
-    if hasattr(ra, '__len__'):
-        # ra is an array
-        neg = np.where(ra < 0.0e0)
-        ra[neg] = ra[neg] + 2.0 * np.pi
-    else:
-        # ra is a scalar
-        if ra < 0: ra += 2.0*np.pi
-        
-    dec = np.arcsin(np.sin(l * dtor) * np.sin(oblt * dtor))
-    
-    if radian :    
-        oblt = oblt * dtor
-        longmed = longmed * dtor
-
-    else:
-        ra = ra / dtor
-        dec = dec / dtor
-   
-    if return_all: 
-        return (ra, dec, oblt, longmed)
-    else: 
-        return (ra, dec)
-        
+    _mean_anomaly(t, 445267.11422, 350.7376814, m)
+    m *= dtor
+    np.sin(m, out=m)
+    m *= 6.5
+    l += m
 
+    # Allow for long period terms
+    np.multiply(t, 20.20, out=m)
+    m += 231.19
+    m *= dtor
+    np.sin(m, out=m)
+    m *= 6.4
+    l += m
+    l += 2592000.0e0
+    np.mod(l, 1296000.0e0, out=l)
+    if len(out) > 3:
+        np.multiply(l, dtor / 3600.0 if radian else 1 / 3600.0, out=out[3])
 
+    # Allow for Aberration
+    l -= 20.5e0
 
+    # Allow for Nutation using the longitude of the Moons mean node OMEGA;
+    # the true obliquity (degrees) goes into me, which is no longer needed
+    _mean_anomaly(t, 1934.142008, -259.183275, m)
+    m *= -dtor
+    np.sin(m, out=arg)
+    arg *= 17.2
+    l -= arg
+    np.cos(m, out=arg)
+    arg *= 9.2 / 3600.0e0
+    np.multiply(t, -0.0130125, out=me)
+    me += 23.452294
+    me += arg
+    if len(out) > 2:
+        np.multiply(me, dtor if radian else 1.0, out=out[2])
 
+    # Form Right Ascension and Declination
+    l *= dtor / 3600.0e0
+    me *= dtor
+    np.sin(l, out=arg)
+    np.cos(me, out=tmp)
+    tmp *= arg
+    np.cos(l, out=m)
+    np.arctan2(tmp, m, out=t)
+    np.add(t, 2.0 * np.pi, out=t, where=t < 0.0)
+    np.sin(me, out=tmp)
+    arg *= tmp
+    np.arcsin(arg, out=arg)
+    if radian:
+        out[0][...] = t
+        out[1][...] = arg
+    else:
+        np.divide(t, dtor, out=out[0])
+        np.divide(arg, dtor, out=out[1])
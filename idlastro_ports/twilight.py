@@ -0,0 +1,182 @@
+"""
+Sunrise, sunset and twilight times for many sites and nights at once.
+
+Built on sunpos, with the local sidereal time and the hour angle and altitude of the
+Sun. For every (site, night) pair the Sun's altitude is evaluated at its transit, its
+lower culmination and its next transit, where it peaks and dips; where it passes
+through the wanted altitude in between, the crossing is bracketed, started from the hour
+angle at which a Sun fixed at its midnight position would cross, and refined by
+safeguarded Newton iterations on the sine of the altitude, for all pairs together.
+
+Latitudes and longitudes are in degrees, longitude positive to the east, and Julian
+dates are taken as UT.
+"""
+import datetime
+
+import numpy as np
+
+from gcirc import d2r
+from sunpos import sunpos
+
+# Altitudes of the centre of the Sun, in degrees, defining each event. 'sunset' allows
+# for the semi-diameter of the Sun and for refraction at the horizon.
+TWILIGHT = {'sunset': -0.8333, 'civil': -6.0, 'nautical': -12.0, 'astronomical': -18.0}
+
+_twilight_cache = dict()
+
+
+def local_sidereal_time(jd, longitude, radian=False):
+    """ Local mean sidereal time at Julian dates jd and east longitudes, in degrees
+    (or radians if radian is set) from 0 to 360. Uses the IAU 1982 expression for GMST. """
+    d = np.asarray(jd, dtype=np.float64) - 2451545.0
+    t = d / 36525.0
+    lst = 280.46061837 + 360.98564736629 * d + t * t * (0.000387933 - t / 38710000.0)
+    lst = np.mod(lst + longitude, 360.0)
+    return lst * d2r if radian else lst
+
+
+def sun_altitude(jd, latitude, longitude):
+    """ Altitude of the Sun in degrees, and its hour angle in degrees from -180 to 180,
+    seen from the given sites at Julian dates jd. The inputs are broadcast together. """
+    ra, dec = sunpos(jd, radian=True)
+    ha = local_sidereal_time(jd, longitude, radian=True) - ra
+    ha = np.mod(ha + np.pi, 2 * np.pi) - np.pi
+    lat = np.asarray(latitude, dtype=np.float64) * d2r
+    sinalt = np.sin(lat) * np.sin(dec) + np.cos(lat) * np.cos(dec) * np.cos(ha)
+    return np.arcsin(np.clip(sinalt, -1, 1)) / d2r, ha / d2r
+
+
+def _sin_altitude(jd, sinlat, coslat, longitude):
+    """ sin(altitude) of the Sun, and its derivative with respect to jd (per day, for
+    the hour angle only) """
+    ra, dec = sunpos(jd, radian=True)
+    ha = local_sidereal_time(jd, longitude, radian=True) - ra
+    coslat_cosdec = coslat * np.cos(dec)
+    value = sinlat * np.sin(dec) + coslat_cosdec * np.cos(ha)
+    return value, -coslat_cosdec * np.sin(ha) * (2 * np.pi)
+
+
+def _culmination(jd, longitude, hour_angle, niter=2):
+    """ Julian dates near jd at which the Sun's hour angle is hour_angle (0 for its
+    transit, pi for its lower culmination), by iterating on the hour angle """
+    for i in range(niter):
+        ra = sunpos(jd, radian=True)[0]
+        ha = local_sidereal_time(jd, longitude, radian=True) - ra - hour_angle
+        jd = jd - (np.mod(ha + np.pi, 2 * np.pi) - np.pi) / (2 * np.pi)
+    return jd
+
+
+def _refine(lo, hi, guess, target, sinlat, coslat, longitude, niter):
+    """ Safeguarded Newton iterations for sin(altitude) = target within the brackets
+    [lo, hi], where sin(altitude) - target changes sign (either way) """
+    f_lo = _sin_altitude(lo, sinlat, coslat, longitude)[0] - target
+    t = np.where((guess > lo) & (guess < hi), guess, (lo + hi) / 2)
+    for i in range(niter):
+        f, dfdt = _sin_altitude(t, sinlat, coslat, longitude)
+        f -= target
+        if np.all(np.abs(f) < 1e-12):
+            break
+        # keep the side of the bracket with the same sign as f at lo
+        same = np.sign(f) == np.sign(f_lo)
+        lo = np.where(same, t, lo)
+        hi = np.where(same, hi, t)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = t - f / dfdt
+        t = np.where((step >= lo) & (step <= hi), step, (lo + hi) / 2)
+    return t
+
+
+def altitude_crossings(latitude, longitude, jd_date, altitude=TWILIGHT['sunset'], niter=10):
+    """ Times at which the Sun sets and rises through an altitude, for every site and night.
+
+    Parameters
+    ----------
+    latitude, longitude : array_like, shape (nsite,)
+        Sites, in degrees, longitude positive to the east
+    jd_date : array_like, shape (nnight,)
+        Julian dates of 0h UT on the dates on which the nights begin
+    altitude : float
+        Altitude of the centre of the Sun, in degrees; see TWILIGHT
+    niter : int
+        Largest number of Newton iterations. Three or four are usually enough; the
+        rest are for grazing crossings near the poles, where the Sun moves slowly in
+        altitude.
+
+    Returns
+    -------
+    evening, morning : ndarray, shape (nsite, nnight)
+        Julian dates at which the Sun descends through the altitude between its transit
+        and its lower culmination, and rises through it between then and its next
+        transit; NaN where it does not (midnight Sun or polar night).
+    """
+    latitude = np.atleast_1d(np.asarray(latitude, dtype=np.float64))[:, None]
+    longitude = np.atleast_1d(np.asarray(longitude, dtype=np.float64))[:, None]
+    jd_date = np.atleast_1d(np.asarray(jd_date, dtype=np.float64))[None, :]
+    sinlat, coslat = np.sin(latitude * d2r), np.cos(latitude * d2r)
+    target = np.sin(altitude * d2r)
+
+    # the Sun's upper culmination (transit) nearest local mean noon, the following lower
+    # culmination and the next transit: the altitude peaks and dips there, so each
+    # crossing is bracketed between a pair of them
+    noon = jd_date + 0.5 - longitude / 360.0
+    transit = _culmination(noon, longitude, 0.0)
+    midnight = _culmination(transit + 0.5, longitude, np.pi)
+    next_transit = _culmination(transit + 1.0, longitude, 0.0)
+    f = [_sin_altitude(t, sinlat, coslat, longitude)[0] - target
+         for t in (transit, midnight, next_transit)]
+    dec = sunpos(midnight, radian=True)[1]
+
+    # first guesses: the hour angles at which the Sun, fixed at its midnight position,
+    # crosses the altitude either side of its transit
+    with np.errstate(invalid='ignore'):
+        h0 = np.arccos((target - sinlat * np.sin(dec)) / (coslat * np.cos(dec))) / (2 * np.pi)
+
+    sinlat, coslat, longitude = [np.broadcast_to(a, transit.shape)
+                                 for a in (sinlat, coslat, longitude)]
+    results = []
+    for f0, f1, lo, hi, guess in ((f[0], f[1], transit, midnight, transit + h0),
+                                  (f[1], f[2], midnight, next_transit, next_transit - h0)):
+        crosses = (f0 > 0) != (f1 > 0)
+        t = np.full(transit.shape, np.nan)
+        if crosses.any():
+            t[crosses] = _refine(lo[crosses], hi[crosses], guess[crosses], target,
+                                 sinlat[crosses], coslat[crosses], longitude[crosses], niter)
+        results.append(t)
+    return tuple(results)
+
+
+def twilight_year(latitude, longitude, year, kind='astronomical'):
+    """ Evening and morning times of a twilight (or of sunset and sunrise) for every
+    night of a year, at each of a list of sites.
+
+    Parameters
+    ----------
+    latitude, longitude : array_like, shape (nsite,)
+        Sites, in degrees, longitude positive to the east; broadcast against each other
+    year : int
+        Calendar year; nights begin on each date from January 1 to December 31
+    kind : string or float
+        One of the keys of TWILIGHT, or an altitude of the Sun in degrees
+
+    Returns
+    -------
+    evening, morning : ndarray, shape (nsite, ndays)
+        As for altitude_crossings. Results are cached per site and year, so that repeat
+        calls only compute the sites not seen before.
+    """
+    altitude = TWILIGHT[kind] if kind in TWILIGHT else float(kind)
+    latitude = np.atleast_1d(np.asarray(latitude, dtype=np.float64))
+    longitude = np.atleast_1d(np.asarray(longitude, dtype=np.float64))
+    latitude, longitude = np.broadcast_arrays(latitude, longitude)
+    jd0 = datetime.date(year, 1, 1).toordinal() + 1721424.5
+    ndays = datetime.date(year, 12, 31).toordinal() - datetime.date(year, 1, 1).toordinal() + 1
+
+    keys = [(lat, lon, year, altitude) for lat, lon in zip(latitude, longitude)]
+    missing = [i for i, key in enumerate(keys) if key not in _twilight_cache]
+    if missing:
+        evening, morning = altitude_crossings(latitude[missing], longitude[missing],
+                                              jd0 + np.arange(ndays), altitude)
+        for n, i in enumerate(missing):
+            _twilight_cache[keys[i]] = (evening[n], morning[n])
+    evening, morning = zip(*[_twilight_cache[key] for key in keys])
+    return np.array(evening), np.array(morning)
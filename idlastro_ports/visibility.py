@@ -0,0 +1,99 @@
+"""
+Sun-avoidance visibility windows for a list of targets over a range of dates.
+
+The Sun is computed once per epoch, on a regular grid of epochs, and the solar
+elongation of every target at every epoch is compared against the allowed band as a dot
+product of unit vectors, a block of targets at a time. Each run of visible epochs is one
+window; its ends are placed where the elongation crosses the band limit, interpolating
+between the epochs on either side. Memory use is bounded by the block size, whatever
+the number of targets and epochs.
+"""
+import numpy as np
+
+from gcirc import _to_radians, _unit_vectors, d2r
+from sunpos import sunpos
+
+
+def _crossing(dot, row, before, after, epochs, cos_min, cos_max):
+    """ Epochs where the dot products dot[row, before] -> dot[row, after] cross the band
+    limit they pass through, by linear interpolation """
+    d0 = dot[row, before]
+    d1 = dot[row, after]
+    # one end is inside the band; if the other is on the Sun's side of it, the limit
+    # crossed is the minimum angle, else the maximum
+    limit = np.where(np.maximum(d0, d1) > cos_min, cos_min, cos_max)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.clip(np.nan_to_num((limit - d0) / (d1 - d0)), 0., 1.)
+    return epochs[before] + frac * (epochs[after] - epochs[before])
+
+
+def sun_visibility_windows(ra, dc, jd_start, jd_end, min_sun_angle, max_sun_angle=180.,
+        step=1.0, units_in='degrees', ephemeris=None, max_elements=2**22):
+    """ Windows of time when each target is inside the allowed band of solar elongation.
+
+    Parameters
+    ----------
+    ra, dc : array_like
+        Target positions, in units_in; each is flattened
+    jd_start, jd_end : float
+        Julian dates to search between
+    min_sun_angle, max_sun_angle : float
+        Allowed range of the angle between target and Sun, in degrees
+    step : float
+        Spacing of the epochs at which visibility is sampled, in days. Windows shorter
+        than this may be missed; window ends are interpolated between epochs.
+    units_in : string
+        As for gcirc
+    ephemeris : SunEphemeris, optional
+        Evaluate the Sun from this fitted ephemeris (see sunephem) instead of sunpos
+    max_elements : int
+        Size of the block of the target x epoch grid evaluated at a time
+
+    Returns
+    -------
+    target : ndarray of int
+        Index of the target of each window; windows are sorted by target then start
+    start, end : ndarray
+        Julian dates of the start and end of each window. A window open at jd_start or
+        jd_end is cut off there.
+    """
+    rarad, dcrad = _to_radians(np.ravel(ra), np.ravel(dc), units_in)
+    targets = _unit_vectors(*np.broadcast_arrays(rarad, dcrad))
+
+    nepoch = max(2, int(np.ceil((jd_end - jd_start) / step)) + 1)
+    epochs = np.minimum(jd_start + step * np.arange(nepoch), jd_end)
+    sun_ra, sun_dc = (ephemeris.sunpos if ephemeris is not None else sunpos)(epochs, radian=True)
+    sun = _unit_vectors(sun_ra, sun_dc)
+
+    cos_min = np.cos(min_sun_angle * d2r)
+    cos_max = np.cos(max_sun_angle * d2r)
+
+    block = max(1, max_elements // nepoch)
+    dot = np.empty((min(block, len(targets)), nepoch))
+    visible = np.zeros((dot.shape[0], nepoch + 2), dtype=np.int8)
+    found = []
+    for first in range(0, len(targets), block):
+        rows = slice(first, first + block)
+        n = len(targets[rows])
+        np.dot(targets[rows], sun.T, out=dot[:n])
+        inside = visible[:n, 1:-1].view(bool)
+        np.less_equal(dot[:n], cos_min, out=inside)
+        inside &= dot[:n] >= cos_max
+
+        # each run of visible epochs starts at a rise in the padded mask, and ends at a fall
+        change = np.diff(visible[:n], axis=1)
+        row, start = np.nonzero(change == 1)
+        end = np.nonzero(change == -1)[1] - 1
+
+        jd0 = epochs[start]
+        jd1 = epochs[end]
+        cut = start > 0
+        jd0[cut] = _crossing(dot, row[cut], start[cut]-1, start[cut], epochs, cos_min, cos_max)
+        cut = end < nepoch - 1
+        jd1[cut] = _crossing(dot, row[cut], end[cut], end[cut]+1, epochs, cos_min, cos_max)
+        found.append((row + first, jd0, jd1))
+
+    if not found:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0)
+    target, start, end = [np.concatenate(a) for a in zip(*found)]
+    return target, start, end
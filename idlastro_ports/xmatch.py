@@ -0,0 +1,153 @@
+"""
+Positional cross-matching of catalogs, using the same units conventions as gcirc.
+
+Positions are converted to unit vectors and catalog 2 is indexed with a KD-tree
+(scipy.spatial.cKDTree), so matching N positions against M costs about O(N log M)
+rather than the O(N M) of calling gcirc on every pair. Separations are computed
+from the chord lengths returned by the tree, which is exact and accurate at all angles.
+
+    xmatch_nearest -- nearest neighbour in catalog 2 of each position in catalog 1
+    xmatch_within  -- all pairs closer than a given radius
+    xmatch_index   -- build the index of a catalog once, for repeated matching
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from gcirc import _to_radians, _angle_scale, _unit_vectors
+from posang import posang as _posang
+
+
+def _chord(angle):
+    """ Straight-line distance between unit vectors separated by angle (radians) """
+    return 2 * np.sin(np.minimum(angle, np.pi) / 2)
+
+
+def _chord_to_angle(chord):
+    """ Angle in radians between unit vectors separated by chord """
+    return 2 * np.arcsin(np.minimum(chord / 2, 1))
+
+
+def _unit_vectors_to_radians(xyz):
+    """ RA, Dec in radians of (N, 3) unit vectors """
+    return np.arctan2(xyz[:,1], xyz[:,0]), np.arctan2(xyz[:,2], np.hypot(xyz[:,0], xyz[:,1]))
+
+
+def xmatch_index(ra, dc, units_in='degrees'):
+    """ Build the KD-tree index of a catalog, to pass as the index argument of
+    xmatch_nearest or xmatch_within when matching against the same catalog repeatedly. """
+    return cKDTree(_unit_vectors(*_to_radians(np.ravel(ra), np.ravel(dc), units_in)))
+
+
+def _position_angles(rarad1, dcrad1, rarad2, dcrad2, units_out):
+    """ Position angles of matched pairs, in radians if units_out is radians, else degrees """
+    return _posang(rarad1, dcrad1, rarad2, dcrad2, units_in='radians',
+                   units_out='radians' if units_out == 'radians' else 'degrees')
+
+
+def xmatch_nearest(ra1, dc1, ra2, dc2, max_sep=None, units_in='degrees', units_out='arcsec',
+        posang=False, index=None, chunksize=1000000):
+    """ Find the nearest neighbour in catalog 2 of every position in catalog 1.
+
+    Parameters
+    ----------
+    ra1, dc1 : array_like
+        Positions to match; each is flattened
+    ra2, dc2 : array_like
+        Catalog to match against; not needed (may be None) if index is given
+    max_sep : float
+        If set, only report neighbours within this separation, in units_out
+    units_in, units_out : string
+        As for gcirc
+    posang : bool
+        Also return the position angle of each neighbour relative to its catalog 1
+        position, from posang. This is in radians if units_out is 'radians', else degrees.
+    index : cKDTree
+        Index of catalog 2 from xmatch_index, to avoid rebuilding it
+    chunksize : int
+        Number of catalog 1 positions queried at a time, to bound memory use
+
+    Returns
+    -------
+    match : ndarray of int
+        Index in catalog 2 of the nearest neighbour, or -1 if there is none within max_sep
+    sep : ndarray
+        Separation from the nearest neighbour in units_out, or inf where there is none
+    pa : ndarray
+        Position angles (only if posang is set), nan where there is no neighbour
+    """
+    scale = _angle_scale(units_out)
+    if index is None:
+        index = xmatch_index(ra2, dc2, units_in)
+    rarad1, dcrad1 = _to_radians(np.ravel(ra1), np.ravel(dc1), units_in)
+    rarad1, dcrad1 = np.broadcast_arrays(rarad1, dcrad1)
+    bound = np.inf if max_sep is None else _chord(max_sep * scale) * (1 + 1e-12)
+
+    n = rarad1.size
+    match = np.empty(n, dtype=np.intp)
+    sep = np.empty(n)
+    for start in range(0, n, chunksize):
+        chunk = slice(start, start+chunksize)
+        chord, j = index.query(_unit_vectors(rarad1[chunk], dcrad1[chunk]), distance_upper_bound=bound)
+        found = j < index.n
+        match[chunk] = np.where(found, j, -1)
+        sep[chunk] = np.where(found, _chord_to_angle(np.where(found, chord, 0)) / scale, np.inf)
+    if not posang:
+        return match, sep
+
+    pa = np.full(n, np.nan)
+    found = match >= 0
+    rarad2, dcrad2 = _unit_vectors_to_radians(index.data[match[found]])
+    pa[found] = _position_angles(rarad1[found], dcrad1[found], rarad2, dcrad2, units_out)
+    return match, sep, pa
+
+
+def xmatch_within(ra1, dc1, ra2, dc2, radius, units_in='degrees', units_out='arcsec',
+        posang=False, index=None, chunksize=1000000):
+    """ Find all pairs of positions from catalogs 1 and 2 within a given separation.
+
+    Parameters
+    ----------
+    ra1, dc1, ra2, dc2, units_in, units_out, posang, index, chunksize :
+        As for xmatch_nearest
+    radius : float
+        Largest separation to report, in units_out
+
+    Returns
+    -------
+    i, j : ndarray
+        Indices into catalog 1 and catalog 2 of each pair, sorted by i then separation
+    sep : ndarray
+        Separation of each pair, in units_out
+    pa : ndarray
+        Position angle of each pair (only if posang is set)
+    """
+    scale = _angle_scale(units_out)
+    if index is None:
+        index = xmatch_index(ra2, dc2, units_in)
+    rarad1, dcrad1 = _to_radians(np.ravel(ra1), np.ravel(dc1), units_in)
+    rarad1, dcrad1 = np.broadcast_arrays(rarad1, dcrad1)
+    bound = _chord(radius * scale) * (1 + 1e-12)
+
+    found_i, found_j, found_chord = [], [], []
+    for start in range(0, rarad1.size, chunksize):
+        chunk = slice(start, start+chunksize)
+        tree = cKDTree(_unit_vectors(rarad1[chunk], dcrad1[chunk]))
+        pairs = tree.sparse_distance_matrix(index, bound, output_type='ndarray')
+        found_i.append(pairs['i'] + start)
+        found_j.append(pairs['j'])
+        found_chord.append(pairs['v'])
+
+    if not found_i:
+        empty = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0))
+        return empty + (np.zeros(0),) if posang else empty
+    i = np.concatenate(found_i).astype(np.intp)
+    j = np.concatenate(found_j).astype(np.intp)
+    sep = _chord_to_angle(np.concatenate(found_chord))
+    keep = sep <= radius * scale        # drop pairs admitted only by the rounding allowance
+    order = np.lexsort((sep[keep], i[keep]))
+    i, j, sep = i[keep][order], j[keep][order], sep[keep][order] / scale
+    if not posang:
+        return i, j, sep
+
+    rarad2, dcrad2 = _unit_vectors_to_radians(index.data[j])
+    return i, j, sep, _position_angles(rarad1[i], dcrad1[i], rarad2, dcrad2, units_out)